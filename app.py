@@ -1,28 +1,33 @@
 # app.py
 import streamlit as st
-import asyncio
-from workflow.ec_workflow import ExistingCustomerWorkflow
-from workflow.nc_workflow import NewCustomerWorkflow
-from workflow.rag import load_pdf_file, text_split, build_rag_pipeline
-from src.memory import get_memory
+import httpx
+import logging
+import uuid
 from src import config
+from src.helper import StreamTimer
 
-# ---------------- Setup ---------------- #
-# Load RAG Knowledge Base
-extracted_data = load_pdf_file("Data/")
-text_chunks = text_split(extracted_data)
-rag_chain = build_rag_pipeline(text_chunks)
+logger = logging.getLogger(__name__)
 
-# Shared memory
-memory = get_memory()
+# ---------------- Backend Client ---------------- #
+# Routing, workflows and the RAG pipeline live in the chat backend (server.py);
+# this app only renders the conversation.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
-# Initialize workflows
-# Initialize workflows once and persist in session_state
-if "ec_workflow" not in st.session_state:
-    st.session_state.ec_workflow = ExistingCustomerWorkflow()
 
-if "nc_workflow" not in st.session_state:
-    st.session_state.nc_workflow = NewCustomerWorkflow()
+def stream_reply(user_input):
+    """Yield the bot response from the backend as it streams in."""
+    payload = {"session_id": st.session_state.session_id, "message": user_input}
+    try:
+        with httpx.stream("POST", f"{config.CHAT_BACKEND_URL}/chat/stream", json=payload,
+                          timeout=config.CHAT_CLIENT_TIMEOUT_S) as response:
+            response.raise_for_status()
+            for text in response.iter_text():
+                if text:
+                    yield text
+    except httpx.HTTPError:
+        logger.exception("chat backend request failed")
+        yield "Sorry, the assistant is unavailable right now. Please try again in a moment."
 
 
 # ---------------- Streamlit UI ---------------- #
@@ -31,7 +36,6 @@ st.title("🔒 RemoteLock Support Assistant")
 
 if "messages" not in st.session_state:
     st.session_state.messages = [{"role": "bot", "content": "Hi! How can I help you today?"}]
-    st.session_state.stage = "intro"
 
 # Display conversation history
 for msg in st.session_state.messages:
@@ -46,56 +50,12 @@ if user_input:
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    async def process_input(user_input):
-        stage = st.session_state.stage
-        response = None
-        result = None  # <-- define result upfront
-
-        # ---------------- Conversation Flow ---------------- #
-        if stage == "intro":
-            response = "Are you an existing customer or a new customer? Or do you just need general information?"
-            st.session_state.stage = "choose_flow"
-
-        elif stage == "choose_flow":
-            if "new" in user_input.lower():
-                st.session_state.stage = "new_customer"
-                result = await st.session_state.nc_workflow.process(user_input)
-
-                response = result["answer"] if isinstance(result, dict) else result
-
-            elif "exist" in user_input.lower():
-                st.session_state.stage = "existing_customer"
-                result = await st.session_state.ec_workflow.process(user_input)
-
-                response = result["answer"] if isinstance(result, dict) else result
-
-            elif "info" in user_input.lower() or "general" in user_input.lower():
-                rag_answer = rag_chain.run(user_input)
-                response = f"Here’s what I found:\n\n{rag_answer}"
-                st.session_state.stage = "intro"  # reset after answering
-
-            else:
-                response = "Please type 'new', 'existing', or 'general information'."
-
-        elif stage == "new_customer":
-            result = await st.session_state.nc_workflow.process(user_input)
-            response = result["answer"] if isinstance(result, dict) else result
-
-        elif stage == "existing_customer":
-            result = await st.session_state.ec_workflow.process(user_input)
-            response = result["answer"] if isinstance(result, dict) else result
-
-
-        else:
-            response = "Sorry, I didn’t understand. Please say new, existing, or general info."
-
-        return response
-
-
-    # Run async workflow
-    response_text = asyncio.run(process_input(user_input))
-
-    # Show bot response
+    # Stream the bot response from the backend
+    timer = StreamTimer()
     with st.chat_message("bot"):
-        st.markdown(response_text)
+        response_text = st.write_stream(timer.wrap(stream_reply(user_input)))
     st.session_state.messages.append({"role": "bot", "content": response_text})
+
+    # Per-turn time-to-first-token
+    st.session_state.setdefault("turn_timings", []).append({"ttft": timer.ttft, "total": timer.total})
+    logger.info("turn ttft=%.3fs total=%.3fs", timer.ttft or 0.0, timer.total or 0.0)
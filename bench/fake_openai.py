@@ -0,0 +1,180 @@
+# bench/fake_openai.py
+"""
+Local OpenAI-compatible HTTP server for exercising the real client stack
+(ChatOpenAI / OpenAIEmbeddings -> src/llm_client.py pool, limiter and
+single-flight) without the network.
+
+    python -m bench.fake_openai --port 8900 --rate-limit-every 50
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python -m bench.run --http
+
+Serves POST /v1/chat/completions (plain and SSE streaming, with usage) and
+POST /v1/embeddings. Replies come from the same deterministic generators
+as bench/fakes.py. `rate_limit_every=N` answers every Nth request with a
+429 and a Retry-After header.
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import convert_to_messages
+
+from bench.fakes import FakeChatModel, FakeEmbeddings
+
+
+class FakeOpenAIServer:
+    """Threaded fake OpenAI endpoint; `start()` returns its base URL."""
+
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.3, token_delay=0.01, n_tokens=40,
+                 embed_latency=0.05, rate_limit_every=0, retry_after=0.2):
+        self.chat = FakeChatModel(ttft=ttft, token_delay=token_delay, n_tokens=n_tokens)
+        self.embeddings = FakeEmbeddings(latency=0.0)
+        self.embed_latency = embed_latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _throttle(self):
+        with self._lock:
+            self.requests += 1
+            limited = bool(self.rate_limit_every) and self.requests % self.rate_limit_every == 0
+            self.throttled += limited
+        return limited
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, payload, headers=()):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if server._throttle():
+                    self._json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                               [("Retry-After", str(server.retry_after))])
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(payload)
+                elif self.path.endswith("/embeddings"):
+                    self._embeddings(payload)
+                else:
+                    self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def _chat(self, payload):
+                messages = convert_to_messages(payload.get("messages", []))
+                tokens = server.chat._tokens(messages)
+                model = payload.get("model", "fake")
+                usage = {
+                    "prompt_tokens": sum(len(str(m.content)) // 4 for m in messages),
+                    "completion_tokens": len(tokens),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                time.sleep(server.chat.ttft)
+                if not payload.get("stream"):
+                    time.sleep(server.chat.token_delay * (len(tokens) - 1))
+                    self._json(200, {
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                        "model": model, "usage": usage,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def event(data):
+                    body = f"data: {data}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(delta, finish=None, **extra):
+                    return json.dumps({
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra,
+                    })
+
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(server.chat.token_delay)
+                    event(chunk({"role": "assistant", "content": token} if i == 0 else {"content": token}))
+                event(chunk({}, "stop"))
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    event(json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                                      "model": model, "choices": [], "usage": usage}))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _embeddings(self, payload):
+                inputs = payload.get("input", [])
+                inputs = [inputs] if isinstance(inputs, (str, int)) or (inputs and isinstance(inputs[0], int)) else inputs
+                # Token-id inputs (tiktoken pre-chunking) are hashed as space-joined ids
+                texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+                time.sleep(server.embed_latency)
+                vectors = server.embeddings.embed_documents(texts)
+                tokens = sum(len(text) // 4 for text in texts)
+                self._json(200, {
+                    "object": "list", "model": payload.get("model", "fake"),
+                    "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI API on localhost")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with a 429")
+    args = parser.parse_args(argv)
+
+    server = FakeOpenAIServer(args.host, args.port, args.ttft, args.token_delay, args.tokens,
+                              args.embed_latency, args.rate_limit_every)
+    print(f"fake OpenAI API on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
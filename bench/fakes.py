@@ -0,0 +1,235 @@
+# bench/fakes.py
+"""
+Deterministic local stand-ins for the paid backends, with injectable latency.
+
+- FakeChatModel      ChatOpenAI (time-to-first-token + per-token delay, streams)
+- FakeEmbeddings     OpenAIEmbeddings (hashed bag-of-words vectors)
+- FakePinecone       PineconeVectorStore (a LocalVectorIndex plus query latency)
+- FakeTable          pyairtable Table (`all(formula=...)`, `batch_create`)
+
+Outputs depend only on the inputs, so runs are repeatable.
+"""
+import re
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.vectorstores import VectorStore
+
+from workflow.intent import keyword_score
+from workflow.vector_index import LocalVectorIndex
+
+_WORD_RE = re.compile(r"\w+")
+
+_VOCABULARY = (
+    "remotelock lock door access code guest wifi hub battery schlage yale reset "
+    "integration schedule portal account billing invoice support firmware offline "
+    "install bluetooth keypad user permission property rental office resident"
+).split()
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+# ---------------- LLM ---------------- #
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers after `ttft` seconds and streams `n_tokens` words
+    `token_delay` seconds apart. Intent-classification prompts get a label
+    from the local keyword heuristic.
+    """
+
+    ttft: float = 0.3
+    token_delay: float = 0.01
+    n_tokens: int = 40
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        system = next((m.content for m in messages if m.type == "system"), "")
+        last = messages[-1].content if messages else ""
+        if "Classify the user input" in system:
+            return ["rag_query" if keyword_score(last) > 0 else "onboarding_flow"]
+        rng = np.random.default_rng(_seed("\n".join(str(m.content) for m in messages)))
+        words = rng.choice(_VOCABULARY, size=self.n_tokens)
+        return [("" if i == 0 else " ") + word for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.ttft + self.token_delay * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.ttft + self.token_delay * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.ttft)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.ttft)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+# ---------------- Embeddings ---------------- #
+class FakeEmbeddings(Embeddings):
+    """
+    Sum of per-word random vectors, so texts sharing words are similar.
+    Each call sleeps `latency` seconds (one API round trip, batch or not).
+    """
+
+    def __init__(self, size=256, latency=0.05):
+        self.size = size
+        self.latency = latency
+        self.calls = 0
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word):
+        vector = self._words.get(word)
+        if vector is None:
+            vector = np.random.default_rng(_seed(word)).standard_normal(self.size).astype(np.float32)
+            self._words[word] = vector
+        return vector
+
+    def _embed(self, text):
+        words = _WORD_RE.findall(text.lower()) or [""]
+        vector = np.sum([self._word_vector(word) for word in words], axis=0)
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# ---------------- Vector Store ---------------- #
+class FakePinecone(VectorStore):
+    """Delegates to a LocalVectorIndex and adds a network round trip per query."""
+
+    def __init__(self, index, latency=0.03):
+        self.index = index
+        self.latency = latency
+
+    @property
+    def embeddings(self):
+        return self.index.embeddings
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        return self.index.add_texts(texts, metadatas=metadatas, ids=ids, **kwargs)
+
+    def delete(self, ids=None, **kwargs):
+        return self.index.delete(ids, **kwargs)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        vector = self.embeddings.embed_query(query)
+        time.sleep(self.latency)
+        return self.index.similarity_search_with_score_by_vector(vector, k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        time.sleep(self.latency)
+        return [doc for doc, _ in self.index.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index_dir=None, latency=0.03, **kwargs):
+        """Build a LocalVectorIndex (in a scratch dir unless `index_dir` is given) and wrap it."""
+        index_dir = index_dir or tempfile.mkdtemp(prefix="fake-pinecone-")
+        index = LocalVectorIndex.from_texts(texts, embedding, metadatas=metadatas, ids=ids, index_dir=index_dir, **kwargs)
+        return cls(index, latency=latency)
+
+
+# ---------------- Airtable ---------------- #
+class FakeTable:
+    """
+    pyairtable Table stand-in. Every email has two open cases, except emails
+    starting with "nocase", which have none. Each request sleeps `latency`.
+    """
+
+    def __init__(self, latency=0.15):
+        self.latency = latency
+        self.created = []
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def all(self, formula=None, **kwargs):
+        self._request()
+        if "{Spool ID}" in (formula or ""):
+            wanted = set(re.findall(r"\{Spool ID\}='((?:[^'\\]|\\.)*)'", formula))
+            with self._lock:
+                return [
+                    {"id": f"recnew{i:06d}", "fields": fields}
+                    for i, fields in enumerate(self.created) if fields.get("Spool ID") in wanted
+                ]
+        match = re.search(r"\{Email\}='((?:[^'\\]|\\.)*)'", formula or "")
+        email = match.group(1) if match else ""
+        if email.startswith("nocase"):
+            return []
+        return [
+            {"id": f"rec{_seed(email + str(i)) % 10**8:08d}", "fields": {
+                "Email": email,
+                "Case Title": title,
+                "Category": category,
+                "Description": description,
+                "Status": "Open",
+            }}
+            for i, (title, category, description) in enumerate([
+                ("Lock offline", "Hardware", "my lock shows offline in the portal after a wifi outage"),
+                ("Access code not working", "Software", "guest access code does not open the front door"),
+            ])
+        ]
+
+    def batch_create(self, records, **kwargs):
+        self._request()
+        with self._lock:
+            start = len(self.created)
+            self.created.extend(records)
+        return [{"id": f"recnew{start + i:06d}", "fields": fields} for i, fields in enumerate(records)]
+
+
+def synthetic_corpus(n_chunks=300, words_per_chunk=120, categories=("Billing", "Software", "Hardware", "Partner")):
+    """Deterministic knowledge-base chunks with the metadata the chunk store sets, one PDF per category."""
+    from langchain_core.documents import Document
+    from workflow.chunk_store import CATEGORY_KEY, chunk_id
+
+    rng = np.random.default_rng(0)
+    docs = []
+    for i in range(n_chunks):
+        text = " ".join(rng.choice(_VOCABULARY, size=words_per_chunk))
+        category = categories[i % len(categories)]
+        doc = Document(page_content=text, metadata={
+            "source": f"Data/{category}/synthetic.pdf", "page": i // 4, "start_index": (i % 4) * 600,
+            CATEGORY_KEY: category,
+        })
+        doc.metadata["chunk_id"] = chunk_id(doc)
+        docs.append(doc)
+    return docs
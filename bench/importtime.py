@@ -0,0 +1,72 @@
+# bench/importtime.py
+"""
+Import-time budget for the entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter per
+module and reports its cumulative import time plus the self time spent in
+each top-level package (langchain_core, openai, numpy, ...). Exits non-zero
+when a module exceeds its budget, so it can gate CI.
+
+    python -m bench.importtime
+    python -m bench.importtime --budget-ms 1500 server workflow.rag
+"""
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = ["app", "server", "workflow.chat", "workflow.rag", "workflow.ec_workflow", "workflow.nc_workflow"]
+
+
+def measure(module):
+    """Return (cumulative_us, {top-level package: self_us}) for importing `module`."""
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    packages, total = {}, 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header row
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if name.strip() == module:
+            total = int(cumulative)
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown error"
+        raise RuntimeError(f"import {module} failed: {error}")
+    return total, packages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report `python -X importtime` totals per entry point")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Maximum import time per module")
+    parser.add_argument("--top", type=int, default=5, help="Packages with the most self time to list")
+    args = parser.parse_args(argv)
+
+    over_budget = False
+    for module in args.modules:
+        try:
+            total, packages = measure(module)
+        except RuntimeError as exc:
+            print(f"{module:<24}  ERROR  {exc}")
+            over_budget = True
+            continue
+        status = "ok" if total / 1000.0 <= args.budget_ms else "OVER"
+        over_budget |= status == "OVER"
+        print(f"{module:<24}{total / 1000.0:>9.0f} ms  {status}")
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name:<36}{self_us / 1000.0:>9.0f} ms self")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# bench/run.py
+"""
+Offline load test: replays scripted conversations through the chat routing
+(ChatSession -> EC / NC workflows -> RAG engine) against the fakes in
+bench/fakes.py, so no OpenAI, Pinecone or Airtable calls are made.
+
+    python -m bench.run --concurrency 16 --repeat 10
+    python -m bench.run --conversations my_log.jsonl --llm-ttft 0.5 --out result.json
+
+Conversation files are JSONL. A line with "turns" is replayed as-is; a line
+with only "title"/"body" (e.g. a request log) becomes a general-information
+question. Reports turns/sec, turn latency and time-to-first-token
+percentiles, per-stage latency from src/tracing.py, peak RSS and startup time.
+
+With --http the chat and embedding calls go through the real OpenAI clients
+and the shared pool in src/llm_client.py to bench/fake_openai.py over HTTP.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CONVERSATIONS = Path(__file__).with_name("conversations.jsonl")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline chat benchmark with fake backends")
+    parser.add_argument("--conversations", default=str(DEFAULT_CONVERSATIONS), help="JSONL conversation script")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations in flight at once")
+    parser.add_argument("--repeat", type=int, default=5, help="Replay every conversation this many times")
+    parser.add_argument("--chunks", type=int, default=300, help="Synthetic knowledge-base chunks")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Fake LLM time to first token (s)")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="Fake LLM delay per token (s)")
+    parser.add_argument("--llm-tokens", type=int, default=40, help="Fake LLM answer length in tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Fake embeddings latency per call (s)")
+    parser.add_argument("--vector-latency", type=float, default=0.03, help="Fake Pinecone query latency (s)")
+    parser.add_argument("--airtable-latency", type=float, default=0.15, help="Fake Airtable request latency (s)")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Disable the semantic answer cache")
+    parser.add_argument("--http", action="store_true", help="Call a local fake OpenAI server through the real clients")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="--http: fake server 429s every Nth request")
+    parser.add_argument("--out", help="Write the report as JSON to this path")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir):
+    """Point every cache and spool at a scratch dir; must run before `src.config` is imported."""
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "AIRTABLE_SPOOL_PATH": str(workdir / "airtable_spool.jsonl"),
+        "CHUNK_CACHE_DIR": str(workdir / "chunks"),
+        "SPARSE_INDEX_DIR": str(workdir / "bm25"),
+        "LOCAL_INDEX_DIR": str(workdir / "vector_index"),
+        "EMBEDDING_CACHE_PATH": "",
+        "MEMORY_BACKEND": "memory",
+        "MEMORY_SUMMARIZER": "truncate",
+        "LANGSMITH_TRACING": "false",
+        "TRACING_ENABLED": "true",
+    })
+    if args.no_answer_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+
+def install_fakes(args, workdir):
+    """Swap the paid clients for the fakes; returns the FakeTable (and fake server) for reporting."""
+    from bench.fakes import FakeChatModel, FakeEmbeddings, FakePinecone, FakeTable, synthetic_corpus
+    import langchain_openai
+    from src import config
+    from workflow import rag, ec_workflow
+    from workflow.airtable_store import CaseRepository
+    from workflow.embeddings import CachedEmbeddings, EmbeddingCache
+    from workflow.vector_index import LocalVectorIndex
+    from src.llm_router import get_model_router
+
+    def make_llm(**kwargs):
+        return FakeChatModel(ttft=args.llm_ttft, token_delay=args.llm_token_delay, n_tokens=args.llm_tokens)
+
+    server = None
+    if args.http:
+        from bench.fake_openai import FakeOpenAIServer
+        from src.llm_client import openai_client_kwargs
+        server = FakeOpenAIServer(ttft=args.llm_ttft, token_delay=args.llm_token_delay, n_tokens=args.llm_tokens,
+                                  embed_latency=args.embed_latency, rate_limit_every=args.rate_limit_every)
+        config.OPENAI_BASE_URL = server.start()
+        # Raw strings instead of tiktoken pre-chunking, so no tokenizer download is needed
+        underlying = langchain_openai.OpenAIEmbeddings(check_embedding_ctx_length=False, **openai_client_kwargs())
+    else:
+        underlying = FakeEmbeddings(latency=args.embed_latency)
+
+    chunks = synthetic_corpus(args.chunks)
+    embeddings = CachedEmbeddings(underlying, "fake", cache=EmbeddingCache(path=None))
+    index = LocalVectorIndex.load(workdir / "vector_index", embeddings)
+    index.add_documents(chunks, ids=[doc.metadata["chunk_id"] for doc in chunks])
+    dense = FakePinecone(index, latency=args.vector_latency)
+
+    rag.build_rag_models = lambda: (embeddings, get_model_router().chat_model("rag"))
+    rag.build_vector_store = lambda embeddings: dense
+    rag.load_chunks = lambda data_path, **kwargs: chunks
+    if server is None:
+        # Every ChatOpenAI is created lazily by the model router, so patching the package covers them all
+        langchain_openai.ChatOpenAI = make_llm
+
+    table = FakeTable(latency=args.airtable_latency)
+    ec_workflow._case_repository = CaseRepository(table, spool_path=workdir / "airtable_spool.jsonl")
+    return table, server
+
+
+def load_conversations(path):
+    conversations = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if "turns" in row:
+                turns = row["turns"]
+            else:
+                question = row.get("title") or row.get("body") or row.get("message", "")
+                turns = ["hi", f"general info: {question}"]
+            conversations.append({"id": str(row.get("id") or row.get("request_id") or n), "turns": turns})
+    return conversations
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(np.array(values, dtype=np.float64) * 1000.0, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ---------------- Driver ---------------- #
+async def run_conversation(registry, conversation, session_id, slots, turns):
+    async with slots:
+        session = registry.get(session_id)
+        for message in conversation["turns"]:
+            started = time.perf_counter()
+            ttft = None
+            async for token in session.process_stream(message):
+                if ttft is None and token:
+                    ttft = time.perf_counter() - started
+            turns.append({"latency": time.perf_counter() - started, "ttft": ttft, "stage": session.stage})
+
+
+async def drive(args, conversations):
+    from workflow.chat import SessionRegistry
+
+    registry = SessionRegistry(max_sessions=len(conversations) * args.repeat + 1)
+    slots = asyncio.Semaphore(args.concurrency)
+    turns = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_conversation(registry, conversation, f"{conversation['id']}-{rep}", slots, turns)
+        for rep in range(args.repeat)
+        for conversation in conversations
+    ))
+    return turns, time.perf_counter() - started
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+    configure_environment(args, workdir)
+
+    process_started = time.perf_counter()
+    from workflow.chat import ChatSession  # noqa: F401  (import cost is part of startup)
+    from workflow.rag import get_rag_engine
+    from src.tracing import get_tracer
+    from src.llm_router import get_model_router
+    from src.llm_client import client_stats
+    imported = time.perf_counter()
+    table, server = install_fakes(args, workdir)
+    fakes_ready = time.perf_counter()
+    engine = get_rag_engine().warmup()
+    warmed = time.perf_counter()
+
+    conversations = load_conversations(args.conversations)
+    get_tracer().reset()
+    turns, wall = asyncio.run(drive(args, conversations))
+
+    report = {
+        "conversations": len(conversations) * args.repeat,
+        "turns": len(turns),
+        "concurrency": args.concurrency,
+        "wall_s": wall,
+        "turns_per_s": len(turns) / wall if wall else 0.0,
+        "turn_latency": percentiles([t["latency"] for t in turns]),
+        "ttft": percentiles([t["ttft"] for t in turns if t["ttft"] is not None]),
+        "stages": get_tracer().summary(),
+        "answer_cache": engine.cache_stats(),
+        "context": engine.context_stats(),
+        "models": get_model_router().stats(),
+        "openai_client": client_stats() if server else {},
+        "fake_server": {"requests": server.requests, "throttled": server.throttled} if server else {},
+        "airtable_requests": table.requests,
+        "startup_s": {
+            "imports": imported - process_started,
+            "warmup": warmed - fakes_ready,
+            "total": (imported - process_started) + (warmed - fakes_ready),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"{report['turns']} turns / {report['conversations']} conversations "
+          f"at concurrency {args.concurrency} in {wall:.2f}s -> {report['turns_per_s']:.1f} turns/s")
+    print("turn latency  " + "  ".join(f"{k}={v:.0f}" for k, v in report["turn_latency"].items()))
+    print("ttft          " + "  ".join(f"{k}={v:.0f}" for k, v in report["ttft"].items()))
+    print(f"startup       imports={report['startup_s']['imports']:.2f}s warmup={report['startup_s']['warmup']:.2f}s")
+    print(f"peak rss      {report['peak_rss_mb']:.0f} MB")
+    if server:
+        print(f"openai client {report['openai_client']}  server={report['fake_server']}")
+    for name, usage in sorted(report["models"].items()):
+        print(f"model         {name}: calls={usage['calls']} errors={usage['errors']} "
+              f"fallbacks={usage['fallbacks']} tokens={usage['input_tokens']}/{usage['output_tokens']}")
+    print(f"\n{'stage':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in sorted(report["stages"].items()):
+        print(f"{name:<24}{stats['count']:>8}{stats.get('p50_ms', 0):>10.1f}"
+              f"{stats.get('p95_ms', 0):>10.1f}{stats.get('p99_ms', 0):>10.1f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,13 @@
 # app.py
 import streamlit as st
-from workflow.rag import load_pdf_file, text_split, build_rag_pipeline
+from workflow.rag import get_rag_engine
+from src.helper import StreamTimer
 
 st.set_page_config(page_title="RemoteLock RAG Chatbot", layout="wide")
 st.title("🔑 RemoteLock RAG Chatbot")
 
-# Load data + pipeline once
-if "rag_chain" not in st.session_state:
-    extracted_data = load_pdf_file("Data/")   # Load PDFs
-    text_chunks = text_split(extracted_data)  # Split into chunks
-    st.session_state.rag_chain = build_rag_pipeline(text_chunks)
+# Shared pipeline, built once per process
+rag_engine = get_rag_engine().warmup()
 
 # Chat history
 if "messages" not in st.session_state:
@@ -27,11 +25,11 @@ if query := st.chat_input("Ask me anything about RemoteLock..."):
     with st.chat_message("user"):
         st.markdown(query)
 
-    # Run RAG pipeline
-    result = st.session_state.rag_chain.invoke({"input": query})
-    answer = result["answer"]
+    # Run RAG pipeline, streaming the answer as it is generated
+    timer = StreamTimer()
+    with st.chat_message("assistant"):
+        answer = st.write_stream(timer.wrap(rag_engine.stream_answer(query)))
 
     # Add assistant message
     st.session_state.messages.append({"role": "assistant", "content": answer})
-    with st.chat_message("assistant"):
-        st.markdown(answer)
+    st.session_state.setdefault("turn_timings", []).append({"ttft": timer.ttft, "total": timer.total})
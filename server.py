@@ -0,0 +1,93 @@
+# server.py
+"""
+Long-lived chat backend.
+
+Owns the warm RAG pipeline, the per-session workflows and one event loop per
+worker, so a turn never pays for an index rebuild or a fresh loop. The
+Streamlit app (app.py) is a thin client of this service.
+
+Run with:
+    uvicorn server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Sessions live in the worker that created them; behind a load balancer, route
+by session id (sticky sessions) and set MEMORY_BACKEND=sqlite so conversation
+memory is shared between workers.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from workflow.chat import get_session_registry
+from workflow.rag import get_rag_engine
+from src.tracing import get_tracer
+from src.llm_router import get_model_router
+from src.llm_client import client_stats
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRequest(BaseModel):
+    session_id: str
+    message: str
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the pipeline before taking traffic
+    await asyncio.to_thread(get_rag_engine().warmup)
+    yield
+
+
+app = FastAPI(title="RemoteLock Support Assistant", lifespan=lifespan)
+
+
+# ---------------- Endpoints ---------------- #
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    session = get_session_registry().get(request.session_id)
+    answer = await session.process(request.message)
+    return {"session_id": request.session_id, "answer": answer, "stage": session.stage}
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    session = get_session_registry().get(request.session_id)
+
+    async def tokens():
+        try:
+            async for token in session.process_stream(request.message):
+                yield token
+        except Exception:
+            logger.exception("chat turn failed for session %s", request.session_id)
+            yield "\n\nSorry, something went wrong. Please try again."
+
+    return StreamingResponse(tokens(), media_type="text/plain; charset=utf-8")
+
+
+@app.delete("/chat/{session_id}")
+async def end_session(session_id: str):
+    get_session_registry().drop(session_id)
+    return {"session_id": session_id}
+
+
+@app.get("/healthz")
+async def healthz():
+    return {
+        "status": "ok",
+        "sessions": len(get_session_registry()),
+        "answer_cache": get_rag_engine().cache_stats(),
+        "context": get_rag_engine().context_stats(),
+        "models": get_model_router().stats(),
+        "openai_client": client_stats(),
+        "stages": get_tracer().summary(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency summaries in Prometheus text format."""
+    return get_tracer().render_prometheus()
@@ -8,13 +8,117 @@ load_dotenv()
 AIRTABLE_TOKEN = os.getenv("AIRTABLE_TOKEN")
 AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 AIRTABLE_TABLE_NAME = os.getenv("AIRTABLE_TABLE_NAME")
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))  # requests/sec
+AIRTABLE_CACHE_TTL = float(os.getenv("AIRTABLE_CACHE_TTL", "60"))
+AIRTABLE_SPOOL_PATH = os.getenv("AIRTABLE_SPOOL_PATH", ".cache/airtable_spool.jsonl")
+AIRTABLE_WRITE_WAIT_S = float(os.getenv("AIRTABLE_WRITE_WAIT_S", "5"))
+# Text field that stores each ticket's spool id, so a create whose outcome is unknown
+# (timeout, 5xx) is looked up instead of re-sent; empty disables the check
+AIRTABLE_SPOOL_ID_FIELD = os.getenv("AIRTABLE_SPOOL_ID_FIELD", "Spool ID")
 
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LOW_LLM = os.getenv("LOW_LLM", "gpt-4.1-nano")
 HIGH_LLM = os.getenv("HIGH_LLM", "gpt-5-nano")
+RAG_LLM = os.getenv("RAG_LLM", "gpt-4.1-mini")
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))  # per attempt; streams: to the first token
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # e.g. a local fake server
+
+# Shared OpenAI HTTP pool and client-side limits (0 disables a limit)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_KEEPALIVE_EXPIRY_S", "30"))
+LLM_REQUESTS_PER_MIN = int(os.getenv("LLM_REQUESTS_PER_MIN", "500"))
+LLM_TOKENS_PER_MIN = int(os.getenv("LLM_TOKENS_PER_MIN", "200000"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "400"))
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+SPECULATIVE_INTENT = os.getenv("SPECULATIVE_INTENT", "true").lower() == "true"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Embedding cache
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL")) if os.getenv("EMBEDDING_CACHE_TTL") else None
 
 # LangSmith
 LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
 LANGSMITH_PROJECT = os.getenv("LANGSMITH_PROJECT")
 LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
+
+# Knowledge base
+DATA_PATH = os.getenv("DATA_PATH", "Data/")
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", ".cache/chunks")
+SPARSE_INDEX_DIR = os.getenv("SPARSE_INDEX_DIR", ".cache/bm25")
+# JSON {"glob pattern": "Category"}; defaults to <DATA_PATH>/categories.json, then sub-directory names
+CATEGORY_MAP_PATH = os.getenv("CATEGORY_MAP_PATH", "")
+DEFAULT_CATEGORY = os.getenv("DEFAULT_CATEGORY", "General")
+
+# Vector store: "pinecone" or "local"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "remote-lock")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".cache/vector_index")
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")  # "exact" or "ivf"
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+
+# Hybrid retrieval per-leg timeouts (seconds)
+DENSE_TIMEOUT_S = float(os.getenv("DENSE_TIMEOUT_S", "2.0"))
+SPARSE_TIMEOUT_S = float(os.getenv("SPARSE_TIMEOUT_S", "1.0"))
+
+# RAG calls from the workflows
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "8"))
+RAG_TIMEOUT_S = float(os.getenv("RAG_TIMEOUT_S", "30"))
+
+# Semantic answer cache
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Conversation memory: "memory" (per process) or "sqlite" (shared by workers)
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory").lower()
+MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", ".cache/memory.sqlite")
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", "3600"))
+MEMORY_SUMMARIZER = os.getenv("MEMORY_SUMMARIZER", "llm").lower()  # "llm" or "truncate"
+
+# Chat backend (server.py) and the Streamlit client that talks to it
+CHAT_BACKEND_URL = os.getenv("CHAT_BACKEND_URL", "http://localhost:8000")
+CHAT_CLIENT_TIMEOUT_S = float(os.getenv("CHAT_CLIENT_TIMEOUT_S", "120"))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "3600"))
+
+# Context packing before the stuff-documents prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+
+# Cross-encoder rerank stage (off by default; needs sentence-transformers)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # k per retrieval leg
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_QUANTIZE = os.getenv("RERANK_QUANTIZE", "true").lower() == "true"
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+# Local tracing (independent of LangSmith): per-stage latency windows, optional JSONL sink
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH") or None
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "1000"))
+
+# Model router: easy RAG questions -> LOW_LLM, hard ones -> HIGH_LLM, the rest -> RAG_LLM
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_EASY_MAX = float(os.getenv("ROUTER_EASY_MAX", "0.25"))  # difficulty score, 0-1
+ROUTER_HARD_MIN = float(os.getenv("ROUTER_HARD_MIN", "0.6"))
+ROUTER_LOW_MAX_PROMPT_TOKENS = int(os.getenv("ROUTER_LOW_MAX_PROMPT_TOKENS", "1200"))
+ROUTER_FALLBACK = os.getenv("ROUTER_FALLBACK", "true").lower() == "true"
+
+# Bulk answering (workflow/batch.py)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "256"))  # queries retrieved per block
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))  # answers generated at once
+
+# Existing customers: prefetch suggested solutions for listed open cases
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_CASES = int(os.getenv("PREFETCH_MAX_CASES", "5"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+PREFETCH_WAIT_S = float(os.getenv("PREFETCH_WAIT_S", "2"))  # then the chosen case is answered live
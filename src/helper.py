@@ -0,0 +1,57 @@
+import time
+
+
+class StreamTimer:
+    """Wraps a token stream and records time-to-first-token and total time (seconds)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.total = None
+
+    def _on_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def wrap(self, stream):
+        for token in stream:
+            self._on_token()
+            yield token
+        self.total = time.perf_counter() - self.started
+
+    async def awrap(self, stream):
+        async for token in stream:
+            self._on_token()
+            yield token
+        self.total = time.perf_counter() - self.started
+
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count via tiktoken when available, else a ~4 chars/token estimate."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4) if text else 0
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut `text` to at most `max_tokens` tokens (same tokenizer as `count_tokens`)."""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
@@ -0,0 +1,466 @@
+"""
+Shared HTTP layer for every OpenAI client (chat models and embeddings).
+
+All clients are built with `openai_client_kwargs()`, so they share one
+keep-alive connection pool per process (sync and async) and go through one
+`PriorityRateLimiter`:
+
+- token buckets for requests/min and tokens/min (estimated from the request
+  body, corrected from the response's `usage` when it has one);
+- waiters are served in priority order, so interactive turns overtake
+  background work (`with llm_priority(BACKGROUND): ...` for prefetch and
+  ingestion);
+- a 429 pauses the whole limiter for Retry-After instead of letting every
+  caller retry on its own.
+
+Identical non-streaming requests in flight at the same time are coalesced
+into one (single-flight). Set OPENAI_BASE_URL to point everything at a local
+OpenAI-compatible server (e.g. `python -m bench.fake_openai`).
+"""
+import json
+import heapq
+import time
+import asyncio
+import hashlib
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import httpx
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+# Longest a queued request sleeps before re-checking, in case a wake-up is missed
+_IDLE_WAIT_S = 1.0
+
+
+@contextmanager
+def llm_priority(level):
+    """Run the enclosed OpenAI calls at `level` (INTERACTIVE or BACKGROUND)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# ---------------- Rate Limiting ---------------- #
+class TokenBucket:
+    """Continuously refilled bucket holding at most `per_minute` units."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost):
+        # A request larger than the whole bucket waits for a full bucket, not forever
+        cost = min(cost, self.capacity)
+        return 0.0 if self.level >= cost else (cost - self.level) / self.rate
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "event", "loop", "done")
+
+    def __init__(self, priority, seq, tokens, event, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.event = event
+        self.loop = loop
+        self.done = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class PriorityRateLimiter:
+    """
+    Requests/min + tokens/min buckets with a priority queue in front.
+
+    Only the head of the queue may take from the buckets, so a background
+    request never consumes capacity an interactive one is waiting for.
+    Thread-safe; `acquire()` blocks, `aacquire()` awaits. A limit of 0
+    disables that bucket.
+    """
+
+    def __init__(self, requests_per_min=0, tokens_per_min=0):
+        self.requests = TokenBucket(requests_per_min) if requests_per_min else None
+        self.tokens = TokenBucket(tokens_per_min) if tokens_per_min else None
+        self.stats = {"granted": 0, "queued": 0, "throttled": 0, "wait_s": 0.0}
+        self._queue = []  # heap of _Ticket
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    def _enqueue(self, tokens, event, loop=None):
+        ticket = _Ticket(_priority.get(), next(self._seq), tokens, event, loop)
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _poll(self, ticket):
+        """0 if `ticket` was granted, else seconds to wait (None: until woken)."""
+        with self._lock:
+            while self._queue and self._queue[0].done:
+                heapq.heappop(self._queue)
+            if self._queue[0] is not ticket:
+                return None
+            now = time.monotonic()
+            wait = self._paused_until - now
+            for bucket, cost in ((self.requests, 1), (self.tokens, ticket.tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(cost))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= ticket.tokens
+            ticket.done = True
+            heapq.heappop(self._queue)
+            self.stats["granted"] += 1
+            self._wake_head()
+            return 0.0
+
+    def _cancel(self, ticket):
+        with self._lock:
+            was_head = bool(self._queue) and self._queue[0] is ticket
+            ticket.done = True
+            if was_head:
+                heapq.heappop(self._queue)
+                self._wake_head()
+
+    def _wake_head(self):
+        while self._queue and self._queue[0].done:
+            heapq.heappop(self._queue)
+        if self._queue:
+            self._queue[0].wake()
+
+    def acquire(self, tokens=0):
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        ticket = self._enqueue(tokens, threading.Event())
+        try:
+            while True:
+                ticket.event.clear()
+                wait = self._poll(ticket)
+                if wait == 0:
+                    break
+                ticket.event.wait(_IDLE_WAIT_S if wait is None else min(wait, _IDLE_WAIT_S))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(started)
+
+    async def aacquire(self, tokens=0):
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        ticket = self._enqueue(tokens, asyncio.Event(), asyncio.get_running_loop())
+        try:
+            while True:
+                ticket.event.clear()
+                wait = self._poll(ticket)
+                if wait == 0:
+                    break
+                try:
+                    await asyncio.wait_for(
+                        ticket.event.wait(), _IDLE_WAIT_S if wait is None else min(wait, _IDLE_WAIT_S)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(started)
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            with self._lock:
+                self.stats["queued"] += 1
+                self.stats["wait_s"] += waited
+
+    def adjust(self, tokens):
+        """Charge (or refund, if negative) tokens once the real usage is known."""
+        if self.tokens is not None and tokens:
+            with self._lock:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level - tokens)
+
+    def pause(self, seconds):
+        """Hold every request for `seconds` (after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.stats["throttled"] += 1
+        # Waiters sleeping on a bucket refill re-check within _IDLE_WAIT_S
+
+
+# ---------------- Request Gate ---------------- #
+def _retry_after(response):
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return 1.0
+
+
+class _Flight:
+    __slots__ = ("event", "status_code", "headers", "content", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status_code = None
+        self.headers = None
+        self.content = None
+        self.error = None
+
+
+class RequestGate:
+    """Rate limiting, 429 back-off and single-flight shared by the sync and async transports."""
+
+    def __init__(self, limiter, single_flight=True, expected_completion_tokens=400):
+        self.limiter = limiter
+        self.single_flight = single_flight
+        self.expected_completion_tokens = expected_completion_tokens
+        self.stats = {"requests": 0, "coalesced": 0}
+        self._flights = {}  # request key -> _Flight / asyncio.Future
+        self._lock = threading.Lock()
+
+    def inspect(self, request):
+        """(estimated tokens, single-flight key or None) for an outgoing request."""
+        try:
+            body = request.content
+            payload = json.loads(body) if body else {}
+        except (httpx.RequestNotRead, ValueError):
+            return 0, None
+        if not isinstance(payload, dict):
+            return len(body) // 4, None
+        tokens = len(body) // 4  # ~4 bytes of JSON per prompt token
+        if request.url.path.endswith("/chat/completions"):
+            tokens += payload.get("max_completion_tokens") or payload.get("max_tokens") or self.expected_completion_tokens
+        if not self.single_flight or request.method != "POST" or payload.get("stream"):
+            return tokens, None
+        key = hashlib.sha1(request.method.encode() + str(request.url).encode() + body).hexdigest()
+        return tokens, key
+
+    def observe(self, response, estimated, content=None):
+        """Feed a finished response back: 429 back-off and token usage correction."""
+        with self._lock:
+            self.stats["requests"] += 1
+        if response.status_code == 429:
+            self.limiter.pause(_retry_after(response))
+            return
+        if content is None or response.status_code != 200:
+            return
+        try:
+            usage = httpx.Response(200, headers=response.headers, content=content).json().get("usage") or {}
+        except (ValueError, AttributeError):
+            return
+        if usage.get("total_tokens"):
+            self.limiter.adjust(usage["total_tokens"] - estimated)
+
+    def _coalesced(self):
+        with self._lock:
+            self.stats["coalesced"] += 1
+
+
+def _copy_response(request, status_code, headers, content):
+    # Raw (still encoded) bytes, so the client decodes each copy as usual
+    return httpx.Response(status_code, headers=headers, content=content, request=request)
+
+
+class PooledTransport(httpx.BaseTransport):
+    """Keep-alive HTTP transport behind a RequestGate (sync clients)."""
+
+    def __init__(self, gate, limits=None):
+        self.gate = gate
+        self._transport = httpx.HTTPTransport(limits=limits or httpx.Limits())
+
+    def _send(self, request, tokens):
+        self.gate.limiter.acquire(tokens)
+        return self._transport.handle_request(request)
+
+    def handle_request(self, request):
+        tokens, key = self.gate.inspect(request)
+        if key is None:
+            response = self._send(request, tokens)
+            self.gate.observe(response, tokens)
+            return response
+
+        with self.gate._lock:
+            flight = self.gate._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.gate._flights[key] = _Flight()
+        if not leader:
+            self.gate._coalesced()
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy_response(request, flight.status_code, flight.headers, flight.content)
+
+        try:
+            response = self._send(request, tokens)
+            try:
+                content = b"".join(response.iter_raw())
+            finally:
+                response.close()
+            self.gate.observe(response, tokens, content)
+            flight.status_code, flight.headers, flight.content = response.status_code, response.headers, content
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.gate._lock:
+                self.gate._flights.pop(key, None)
+            flight.event.set()
+        return _copy_response(request, flight.status_code, flight.headers, flight.content)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """Keep-alive HTTP transport behind a RequestGate (async clients)."""
+
+    def __init__(self, gate, limits=None):
+        self.gate = gate
+        self._transport = httpx.AsyncHTTPTransport(limits=limits or httpx.Limits())
+
+    async def _send(self, request, tokens):
+        await self.gate.limiter.aacquire(tokens)
+        return await self._transport.handle_async_request(request)
+
+    async def handle_async_request(self, request):
+        tokens, key = self.gate.inspect(request)
+        if key is None:
+            response = await self._send(request, tokens)
+            self.gate.observe(response, tokens)
+            return response
+
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        while True:
+            with self.gate._lock:
+                flight = self.gate._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.gate._flights[key] = loop.create_future()
+            if leader:
+                break
+            self.gate._coalesced()
+            try:
+                # Shielded: one follower giving up must not cancel the shared request
+                status_code, headers, content = await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if flight.cancelled():
+                    continue  # the leader was cancelled, not us; send it ourselves
+                raise
+            return _copy_response(request, status_code, headers, content)
+
+        try:
+            response = await self._send(request, tokens)
+            try:
+                content = b"".join([chunk async for chunk in response.aiter_raw()])
+            finally:
+                await response.aclose()
+            self.gate.observe(response, tokens, content)
+            flight.set_result((response.status_code, response.headers, content))
+        except Exception as exc:
+            flight.set_exception(exc)
+            flight.exception()  # retrieved here so a failure nobody awaited isn't logged
+            raise
+        except BaseException:
+            flight.cancel()
+            raise
+        finally:
+            with self.gate._lock:
+                self.gate._flights.pop(key, None)
+        return _copy_response(request, response.status_code, response.headers, content)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# ---------------- Shared Clients ---------------- #
+_gate = None
+_http_client = None
+_async_http_client = None
+_clients_lock = threading.Lock()
+
+
+def get_request_gate():
+    global _gate
+    if _gate is None:
+        with _clients_lock:
+            if _gate is None:
+                _gate = RequestGate(
+                    PriorityRateLimiter(config.LLM_REQUESTS_PER_MIN, config.LLM_TOKENS_PER_MIN),
+                    single_flight=config.LLM_SINGLE_FLIGHT,
+                    expected_completion_tokens=config.LLM_EXPECTED_COMPLETION_TOKENS
+                )
+    return _gate
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=config.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.LLM_MAX_KEEPALIVE,
+        keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY_S
+    )
+
+
+def get_http_clients():
+    """(httpx.Client, httpx.AsyncClient) shared by every OpenAI client in the process."""
+    global _http_client, _async_http_client
+    if _http_client is None:
+        gate = get_request_gate()
+        with _clients_lock:
+            if _http_client is None:
+                _async_http_client = httpx.AsyncClient(
+                    transport=AsyncPooledTransport(gate, _limits()), follow_redirects=True
+                )
+                _http_client = httpx.Client(transport=PooledTransport(gate, _limits()), follow_redirects=True)
+    return _http_client, _async_http_client
+
+
+def openai_client_kwargs():
+    """Keyword arguments wiring a ChatOpenAI / OpenAIEmbeddings into the shared pool."""
+    http_client, http_async_client = get_http_clients()
+    kwargs = {"http_client": http_client, "http_async_client": http_async_client}
+    if config.OPENAI_BASE_URL:
+        kwargs["base_url"] = config.OPENAI_BASE_URL
+    return kwargs
+
+
+def client_stats():
+    gate = get_request_gate()
+    return {**gate.stats, **gate.limiter.stats}
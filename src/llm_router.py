@@ -0,0 +1,349 @@
+"""
+Per-call model routing between the LOW_LLM, RAG_LLM and HIGH_LLM tiers.
+
+`RoutedChatModel` is a drop-in chat model for a fixed task ("intent",
+"onboarding", "summary", "rag", ...). On every call the router picks a tier
+from the task, the prompt length and a cheap difficulty score of the query
+(`route_text` in the run metadata, else the last human message):
+
+- intent / onboarding / summary turns  -> low
+- RAG answers: easy + short prompt     -> low, hard -> high, otherwise rag
+
+A call that errors or times out (for streams: before the first token) is
+retried once on the fallback tier (the OpenAI clients themselves do not
+retry). Each attempt runs in a `model.<name>`
+span, so per-model latency shows up in the tracer; token usage is counted
+per model in `ModelRouter.stats()`.
+"""
+import re
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src import config
+from src.helper import count_tokens
+from src.tracing import get_tracer, span
+
+logger = logging.getLogger(__name__)
+
+# Sync streams pull their first chunk here so the wait can time out
+_first_token_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-first-token")
+
+TIERS = ("low", "rag", "high")
+FALLBACK = {"low": "rag", "rag": "low", "high": "rag"}
+SIMPLE_TASKS = frozenset({"intent", "onboarding", "summary", "chat"})
+
+_HARD_CUES = re.compile(
+    r"\b(why|compare|comparison|difference|versus|vs|troubleshoot\w*|integrat\w*|api|webhook|configur\w*|"
+    r"migrat\w*|multiple|several|still|error|fail\w*|not working|instead)\b",
+    re.IGNORECASE
+)
+_CONJUNCTIONS = re.compile(r"\b(and|also|then|plus)\b", re.IGNORECASE)
+
+
+def difficulty(text):
+    """Cheap 0-1 difficulty estimate: length, multi-part questions and troubleshooting cues."""
+    text = text or ""
+    length = min(len(text.split()) / 60.0, 1.0)
+    parts = min((text.count("?") + len(_CONJUNCTIONS.findall(text))) / 4.0, 1.0)
+    cues = min(len(_HARD_CUES.findall(text)) / 3.0, 1.0)
+    return 0.4 * length + 0.2 * parts + 0.4 * cues
+
+
+def _last_human(messages):
+    return next((str(m.content) for m in reversed(messages) if m.type == "human"), "")
+
+
+def _route_text(config):
+    return ((config or {}).get("metadata") or {}).get("route_text")
+
+
+def _usage(message, messages):
+    """(input_tokens, output_tokens) from the provider's usage, else estimated."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    return sum(count_tokens(str(m.content)) for m in messages), count_tokens(str(message.content))
+
+
+# ---------------- Router ---------------- #
+class ModelUsage:
+    """Running call / error / fallback / token totals for one model."""
+
+    __slots__ = ("calls", "errors", "fallbacks", "input_tokens", "output_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+
+class ModelRouter:
+    """
+    Chooses a tier per call and owns one chat client per (model, temperature);
+    all of them share the pooled, rate-limited HTTP layer in src/llm_client.py.
+    """
+
+    def __init__(self, models=None, enabled=True, easy_max=0.25, hard_min=0.6, low_max_prompt_tokens=1200,
+                 timeout=30.0, fallback=True):
+        self.models = models or {"low": config.LOW_LLM, "rag": config.RAG_LLM, "high": config.HIGH_LLM}
+        self.enabled = enabled
+        self.easy_max = easy_max
+        self.hard_min = hard_min
+        self.low_max_prompt_tokens = low_max_prompt_tokens
+        self.timeout = timeout
+        self.fallback = fallback
+        self._clients = {}  # (model name, temperature) -> chat model
+        self._usage = {}  # model name -> ModelUsage
+        self._lock = threading.Lock()
+
+    def chat_model(self, task, temperature=None):
+        """A chat model that routes every call made for `task`."""
+        return RoutedChatModel(router=self, task=task, temperature=temperature)
+
+    def choose(self, task, text, prompt_tokens=0):
+        """Tier for one call."""
+        if task in SIMPLE_TASKS:
+            return "low"
+        if not self.enabled:
+            return "rag"
+        score = difficulty(text)
+        if score >= self.hard_min:
+            return "high"
+        if score <= self.easy_max and prompt_tokens <= self.low_max_prompt_tokens:
+            return "low"
+        return "rag"
+
+    def plan(self, task, text, prompt_tokens=0):
+        """Tiers to try in order: the chosen one, then its fallback."""
+        tier = self.choose(task, text, prompt_tokens)
+        backup = FALLBACK[tier]
+        if self.fallback and self.models[backup] != self.models[tier]:
+            return [tier, backup]
+        return [tier]
+
+    def client(self, tier, temperature=None):
+        name = self.models[tier]
+        key = (name, temperature)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    from langchain_openai import ChatOpenAI
+                    from src.llm_client import openai_client_kwargs
+                    kwargs = {"temperature": temperature} if temperature is not None else {}
+                    client = self._clients[key] = ChatOpenAI(
+                        model=name,
+                        openai_api_key=config.OPENAI_API_KEY,
+                        timeout=self.timeout,
+                        max_retries=0,  # the router's fallback tier is the retry policy
+                        stream_usage=True,
+                        **openai_client_kwargs(),
+                        **kwargs
+                    )
+        return name, client
+
+    def _record(self, name, input_tokens=0, output_tokens=0, failed=False, fallback=False):
+        with self._lock:
+            usage = self._usage.get(name)
+            if usage is None:
+                usage = self._usage[name] = ModelUsage()
+            usage.calls += 1
+            usage.errors += failed
+            usage.fallbacks += fallback
+            usage.input_tokens += input_tokens
+            usage.output_tokens += output_tokens
+
+    def stats(self):
+        """Per-model calls, errors, fallbacks, tokens and latency percentiles."""
+        stages = get_tracer().summary()
+        with self._lock:
+            usage = list(self._usage.items())
+        return {
+            name: {
+                "calls": u.calls, "errors": u.errors, "fallbacks": u.fallbacks,
+                "input_tokens": u.input_tokens, "output_tokens": u.output_tokens,
+                **{k: v for k, v in stages.get(f"model.{name}", {}).items() if k.endswith("_ms")},
+            }
+            for name, u in usage
+        }
+
+    # ---------------- Calls ---------------- #
+    @staticmethod
+    def _first_chunk(chunks, timeout):
+        """
+        `next(chunks, None)`, raising TimeoutError after `timeout` seconds. The
+        pull runs on the shared first-token pool; a stalled one is abandoned
+        to the client's own request timeout, which frees its worker.
+        """
+        future = _first_token_pool.submit(contextvars.copy_context().run, next, chunks, None)
+        return future.result(timeout=timeout)
+
+    def _can_fall_back(self, plan, attempt, exc, name):
+        if attempt + 1 >= len(plan):
+            return False
+        logger.warning("%s failed (%s); falling back to the %s tier", name, type(exc).__name__, plan[attempt + 1])
+        return True
+
+    def generate(self, plan, task, temperature, messages, stop=None, **kwargs):
+        for attempt, tier in enumerate(plan):
+            name, client = self.client(tier, temperature)
+            with span(f"model.{name}", task=task, tier=tier, fallback=attempt > 0) as current:
+                try:
+                    message = client.invoke(messages, stop=stop, **kwargs)
+                except Exception as exc:
+                    current.set(failed=type(exc).__name__)
+                    self._record(name, failed=True, fallback=attempt > 0)
+                    if self._can_fall_back(plan, attempt, exc, name):
+                        continue
+                    raise
+                input_tokens, output_tokens = _usage(message, messages)
+                current.set(input_tokens=input_tokens, output_tokens=output_tokens)
+            self._record(name, input_tokens, output_tokens, fallback=attempt > 0)
+            return message
+
+    async def agenerate(self, plan, task, temperature, messages, stop=None, **kwargs):
+        for attempt, tier in enumerate(plan):
+            name, client = self.client(tier, temperature)
+            with span(f"model.{name}", task=task, tier=tier, fallback=attempt > 0) as current:
+                try:
+                    message = await asyncio.wait_for(client.ainvoke(messages, stop=stop, **kwargs), self.timeout)
+                except Exception as exc:
+                    current.set(failed=type(exc).__name__)
+                    self._record(name, failed=True, fallback=attempt > 0)
+                    if self._can_fall_back(plan, attempt, exc, name):
+                        continue
+                    raise
+                input_tokens, output_tokens = _usage(message, messages)
+                current.set(input_tokens=input_tokens, output_tokens=output_tokens)
+            self._record(name, input_tokens, output_tokens, fallback=attempt > 0)
+            return message
+
+    def stream(self, plan, task, temperature, messages, stop=None, **kwargs):
+        for attempt, tier in enumerate(plan):
+            name, client = self.client(tier, temperature)
+            with span(f"model.{name}", task=task, tier=tier, fallback=attempt > 0) as current:
+                chunks = client.stream(messages, stop=stop, **kwargs)
+                try:
+                    merged = self._first_chunk(chunks, self.timeout)
+                except Exception as exc:
+                    current.set(failed=type(exc).__name__)
+                    self._record(name, failed=True, fallback=attempt > 0)
+                    if self._can_fall_back(plan, attempt, exc, name):
+                        continue
+                    raise
+                # Once a token is out the answer is committed to this model
+                if merged is not None:
+                    yield merged
+                    for chunk in chunks:
+                        merged += chunk
+                        yield chunk
+                input_tokens, output_tokens = _usage(merged, messages) if merged is not None else (0, 0)
+                current.set(input_tokens=input_tokens, output_tokens=output_tokens)
+            self._record(name, input_tokens, output_tokens, fallback=attempt > 0)
+            return
+
+    async def astream(self, plan, task, temperature, messages, stop=None, **kwargs):
+        for attempt, tier in enumerate(plan):
+            name, client = self.client(tier, temperature)
+            with span(f"model.{name}", task=task, tier=tier, fallback=attempt > 0) as current:
+                chunks = client.astream(messages, stop=stop, **kwargs)
+                try:
+                    merged = await asyncio.wait_for(anext(chunks, None), self.timeout)
+                except Exception as exc:
+                    await chunks.aclose()
+                    current.set(failed=type(exc).__name__)
+                    self._record(name, failed=True, fallback=attempt > 0)
+                    if self._can_fall_back(plan, attempt, exc, name):
+                        continue
+                    raise
+                if merged is not None:
+                    yield merged
+                    async for chunk in chunks:
+                        merged += chunk
+                        yield chunk
+                input_tokens, output_tokens = _usage(merged, messages) if merged is not None else (0, 0)
+                current.set(input_tokens=input_tokens, output_tokens=output_tokens)
+            self._record(name, input_tokens, output_tokens, fallback=attempt > 0)
+            return
+
+
+# ---------------- Chat Model ---------------- #
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model whose calls are routed by a ModelRouter. Pass the query the
+    difficulty score should look at as `config={"metadata": {"route_text": q}}`
+    when the prompt wraps it in other text (e.g. retrieved context).
+    """
+
+    router: Any
+    task: str = "rag"
+    temperature: Optional[float] = None
+
+    @property
+    def _llm_type(self):
+        return "routed-chat"
+
+    # stream() / astream() don't hand the run manager (and its metadata) to
+    # _stream, so the route text travels as a call kwarg instead
+    def stream(self, input, config=None, *, stop=None, **kwargs):
+        return super().stream(input, config, stop=stop, route_text=_route_text(config), **kwargs)
+
+    def astream(self, input, config=None, *, stop=None, **kwargs):
+        return super().astream(input, config, stop=stop, route_text=_route_text(config), **kwargs)
+
+    def _plan(self, messages, run_manager, kwargs):
+        metadata = getattr(run_manager, "metadata", None) or {}
+        text = kwargs.pop("route_text", None) or metadata.get("route_text") or _last_human(messages)
+        prompt_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        return self.router.plan(self.task, text, prompt_tokens)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        plan = self._plan(messages, run_manager, kwargs)
+        message = self.router.generate(plan, self.task, self.temperature, messages, stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        plan = self._plan(messages, run_manager, kwargs)
+        message = await self.router.agenerate(plan, self.task, self.temperature, messages, stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        plan = self._plan(messages, run_manager, kwargs)
+        for chunk in self.router.stream(plan, self.task, self.temperature, messages, stop, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        plan = self._plan(messages, run_manager, kwargs)
+        async for chunk in self.router.astream(plan, self.task, self.temperature, messages, stop, **kwargs):
+            yield ChatGenerationChunk(message=chunk)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Process-wide router (and thus one client per model) shared by every workflow."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter(
+                    enabled=config.ROUTER_ENABLED,
+                    easy_max=config.ROUTER_EASY_MAX,
+                    hard_min=config.ROUTER_HARD_MIN,
+                    low_max_prompt_tokens=config.ROUTER_LOW_MAX_PROMPT_TOKENS,
+                    timeout=config.LLM_TIMEOUT_S,
+                    fallback=config.ROUTER_FALLBACK
+                )
+    return _router
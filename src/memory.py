@@ -1,12 +1,264 @@
-from langchain.memory import ConversationBufferMemory
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
 
-_global_memory = None
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
-def get_memory():
-    global _global_memory
-    if _global_memory is None:
-        _global_memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
+from src import config
+from src.helper import count_tokens
+
+
+# ---------------- Summarizers ---------------- #
+def truncating_summarizer(summary, messages, max_chars=1200):
+    """Cheap fallback: keep the tail of the running transcript."""
+    lines = [summary] if summary else []
+    lines += [f"{role}: {content}" for role, content in messages]
+    return "\n".join(lines)[-max_chars:]
+
+
+def llm_summarizer(llm=None):
+    """Fold older turns into the running summary with a small LLM."""
+    state = {"llm": llm}
+
+    def summarize(summary, messages):
+        if state["llm"] is None:
+            from src.llm_router import get_model_router
+            state["llm"] = get_model_router().chat_model("summary", temperature=0)
+        transcript = "\n".join(f"{role}: {content}" for role, content in messages)
+        prompt = (
+            "Update the running summary of a customer support conversation. Keep names, "
+            "hardware brands, business type, door counts and any open questions. Be brief.\n\n"
+            f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}\n\nUpdated summary:"
+        )
+        return state["llm"].invoke(prompt).content.strip()
+
+    return summarize
+
+
+# ---------------- Backends ---------------- #
+class InMemoryBackend:
+    """Per-process session store with LRU eviction of idle sessions."""
+
+    def __init__(self, max_sessions=1000, idle_ttl=3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # session_id -> (summary, messages, touched_at)
+        self._lock = threading.Lock()
+
+    def read(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return "", []
+            self._sessions.move_to_end(session_id)
+            return entry[0], list(entry[1])
+
+    def write(self, session_id, summary, messages):
+        with self._lock:
+            self._write(session_id, summary, messages)
+
+    def _write(self, session_id, summary, messages):
+        now = time.time()
+        self._sessions[session_id] = (summary, list(messages), now)
+        self._sessions.move_to_end(session_id)
+        while self._sessions:
+            oldest_id, (_, _, touched) = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - touched > self.idle_ttl:
+                del self._sessions[oldest_id]
+            else:
+                break
+
+    def update(self, session_id, change):
+        """Atomically apply `change(summary, messages) -> (summary, messages) | None`; returns the result."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            current = (entry[0], list(entry[1])) if entry is not None else ("", [])
+            updated = change(*current)
+            if updated is None:
+                return current
+            self._write(session_id, *updated)
+            return updated
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteBackend:
+    """Session store in a local SQLite file, shareable by several worker processes."""
+
+    def __init__(self, path, max_sessions=10_000, idle_ttl=24 * 3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, summary TEXT, messages TEXT, touched_at REAL)"
         )
-    return _global_memory
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched_at)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def read(self, session_id):
+        with self._lock:
+            return self._read(session_id)
+
+    def _read(self, session_id):
+        row = self._db.execute(
+            "SELECT summary, messages FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return "", []
+        return row[0], [tuple(m) for m in json.loads(row[1])]
+
+    def write(self, session_id, summary, messages):
+        with self._lock:
+            self._write(session_id, summary, messages)
+            self._db.commit()
+
+    def _write(self, session_id, summary, messages):
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, summary, messages, touched_at) VALUES (?, ?, ?, ?)",
+            (session_id, summary, json.dumps(messages), now)
+        )
+        self._db.execute("DELETE FROM sessions WHERE touched_at < ?", (now - self.idle_ttl,))
+        self._db.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            "SELECT session_id FROM sessions ORDER BY touched_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+
+    def update(self, session_id, change):
+        """Atomically apply `change(summary, messages) -> (summary, messages) | None`; returns the result."""
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so other workers cannot
+            # interleave between this read and the write
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._read(session_id)
+                updated = change(*current)
+                if updated is not None:
+                    self._write(session_id, *updated)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return current if updated is None else updated
+
+    def clear(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+# ---------------- Session Memory ---------------- #
+class MemoryStore:
+    """
+    Session-keyed conversation memory.
+
+    Each session keeps its most recent messages within `token_budget`; older
+    messages are folded into a rolling summary by `summarizer`. The backend
+    evicts idle sessions.
+
+    Appends are atomic read-modify-writes in the backend (and serialized per
+    session within the process). The summarizer runs outside the backend
+    transaction; its result is applied only if the folded messages are
+    still at the head of the session.
+    """
+
+    def __init__(self, backend, token_budget=1500, summarizer=None, lock_stripes=64):
+        self.backend = backend
+        self.token_budget = token_budget
+        self.summarizer = summarizer or truncating_summarizer
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def _session_lock(self, session_id):
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    def get(self, session_id):
+        return SessionMemory(self, session_id)
+
+    def history(self, session_id):
+        summary, messages = self.backend.read(session_id)
+        history = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] if summary else []
+        for role, content in messages:
+            history.append(HumanMessage(content=content) if role == "human" else AIMessage(content=content))
+        return history
+
+    def append(self, session_id, user_message, ai_message):
+        turn = [("human", user_message), ("ai", ai_message)]
+        with self._session_lock(session_id):
+            summary, messages = self.backend.update(session_id, lambda summary, messages: (summary, messages + turn))
+
+            # Over budget: keep the newest messages within half the budget and
+            # summarize the rest, so the summarizer runs every few turns, not every turn
+            if sum(count_tokens(content) for _, content in messages) <= self.token_budget:
+                return
+            kept, used = [], 0
+            for role, content in reversed(messages):
+                used += count_tokens(content)
+                if used > self.token_budget // 2 and kept:
+                    break
+                kept.append((role, content))
+            folded = messages[:len(messages) - len(kept)]
+            new_summary = self.summarizer(summary, folded)
+
+            def fold(current_summary, current):
+                # Another worker may have folded these turns already; appends since are kept
+                if current_summary != summary or current[:len(folded)] != folded:
+                    return None
+                return new_summary, current[len(folded):]
+
+            self.backend.update(session_id, fold)
+
+
+class SessionMemory:
+    """One session's view of the store; exposes the chat_history variable used by the prompts."""
+
+    memory_key = "chat_history"
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def load_memory_variables(self, inputs):
+        return {self.memory_key: self.store.history(self.session_id)}
+
+    def save_turn(self, user_message, ai_message):
+        self.store.append(self.session_id, user_message, ai_message)
+
+    async def asave_turn(self, user_message, ai_message):
+        await asyncio.to_thread(self.save_turn, user_message, ai_message)
+
+    def clear(self):
+        self.store.backend.clear(self.session_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store():
+    """Process-wide memory store configured from src/config.py."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if config.MEMORY_BACKEND == "sqlite":
+                    backend = SQLiteBackend(config.MEMORY_SQLITE_PATH, config.MEMORY_MAX_SESSIONS, config.MEMORY_IDLE_TTL)
+                else:
+                    backend = InMemoryBackend(config.MEMORY_MAX_SESSIONS, config.MEMORY_IDLE_TTL)
+                summarizer = llm_summarizer() if config.MEMORY_SUMMARIZER == "llm" else truncating_summarizer
+                _store = MemoryStore(backend, token_budget=config.MEMORY_TOKEN_BUDGET, summarizer=summarizer)
+    return _store
+
+
+def get_memory(session_id="default"):
+    return get_memory_store().get(session_id)
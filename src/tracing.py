@@ -0,0 +1,191 @@
+"""
+Lightweight in-process tracing.
+
+`span(name, **attrs)` times a stage and nests under the current span via
+contextvars, so it follows a turn across awaits, `asyncio.to_thread` and
+(with `copy_context`) thread-pool legs. Finished spans feed per-stage latency
+windows (p50/p95/p99, exported as Prometheus text by `render_prometheus()`)
+and, when TRACE_JSONL_PATH is set, a JSONL sink. Independent of LangSmith;
+recording a span costs a few microseconds.
+"""
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "started", "duration", "attrs", "error")
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.started = time.time()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def set(self, **attrs):
+        """Attach attributes (token counts, cache hit flags, ...) to the span."""
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started,
+            "duration_ms": self.duration * 1000.0,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# ---------------- Stage Statistics ---------------- #
+class StageStats:
+    """Rolling latency window plus running count / sum / error totals for one stage."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def record(self, seconds, failed):
+        self.latencies.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if failed:
+            self.errors += 1
+
+    def percentiles(self):
+        if not self.latencies:
+            return {}
+        p50, p95, p99 = np.percentile(np.array(self.latencies, dtype=np.float64), [50, 95, 99])
+        return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+class Tracer:
+    """Collects finished spans into per-stage stats and an optional JSONL sink."""
+
+    def __init__(self, enabled=True, jsonl_path=None, window=1000):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._sink = None
+
+    def _record(self, span):
+        with self._lock:
+            stats = self._stages.get(span.name)
+            if stats is None:
+                stats = self._stages[span.name] = StageStats(self.window)
+            stats.record(span.duration, span.error is not None)
+            if self.jsonl_path:
+                self._write(span)
+
+    def _write(self, span):
+        try:
+            if self._sink is None:
+                self._sink = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+            self._sink.write(json.dumps(span.to_dict(), default=str) + "\n")
+        except OSError:
+            logger.exception("trace sink write failed; disabling the JSONL sink")
+            self.jsonl_path = None
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        current = Span(name, _current.get(), attrs)
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            yield current
+        except BaseException as exc:
+            current.error = type(exc).__name__
+            raise
+        finally:
+            current.duration = time.perf_counter() - started
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. an abandoned async generator)
+                pass
+            self._record(current)
+
+    def summary(self):
+        """Per-stage count, errors, mean and p50/p95/p99 in ms."""
+        with self._lock:
+            stages = list(self._stages.items())
+        summary = {}
+        for name, stats in stages:
+            entry = {"count": stats.count, "errors": stats.errors,
+                     "mean_ms": stats.total / stats.count * 1000.0 if stats.count else 0.0}
+            entry.update({f"{q}_ms": v * 1000.0 for q, v in stats.percentiles().items()})
+            summary[name] = entry
+        return summary
+
+    def render_prometheus(self):
+        """Stage latencies in the Prometheus text exposition format (summary type)."""
+        with self._lock:
+            stages = list(self._stages.items())
+        lines = [
+            "# HELP stage_latency_seconds Latency of traced stages.",
+            "# TYPE stage_latency_seconds summary",
+        ]
+        for name, stats in stages:
+            for q, value in stats.percentiles().items():
+                quantile = {"p50": "0.5", "p95": "0.95", "p99": "0.99"}[q]
+                lines.append(f'stage_latency_seconds{{stage="{name}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'stage_latency_seconds_sum{{stage="{name}"}} {stats.total:.6f}')
+            lines.append(f'stage_latency_seconds_count{{stage="{name}"}} {stats.count}')
+        lines += ["# HELP stage_errors_total Traced stages that raised.", "# TYPE stage_errors_total counter"]
+        for name, stats in stages:
+            lines.append(f'stage_errors_total{{stage="{name}"}} {stats.errors}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+_tracer = Tracer(enabled=config.TRACING_ENABLED, jsonl_path=config.TRACE_JSONL_PATH, window=config.TRACE_WINDOW)
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attrs):
+    """Time a stage: `with span("dense", k=3) as s: ...; s.set(hits=2)`."""
+    return _tracer.span(name, **attrs)
+
+
+def current_span():
+    return _current.get() or _NULL_SPAN
@@ -0,0 +1,399 @@
+# workflow/airtable_store.py
+"""
+Airtable access for the existing-customer workflow.
+
+- CaseCache: open-case lookups per email, with a TTL and explicit invalidation.
+- TicketWriter: write-behind queue that batches ticket creates (Airtable takes
+  up to 10 records per request), respects the 5 req/s limit and spools
+  pending records to a local JSONL file so they survive a restart. Each
+  process spools to its own file and, on start, adopts the spools of
+  processes that are no longer running. A 429 is retried after Retry-After
+  (Airtable locks a client out for 30 s); after a timeout or 5xx the create
+  may still have happened, so records are looked up by their spool id
+  before they are sent again.
+
+Everything takes the pyairtable `Table` as a parameter, so a fake table with
+`all(formula=...)` and `batch_create(records)` can be dropped in for tests.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every other spool is treated as orphaned
+    fcntl = None
+
+from src import config
+from src.tracing import current_span, span
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 10
+RATE_LIMIT_LOCKOUT_S = 30.0
+
+
+def escape_formula_value(value):
+    """Escape a value for use inside a single-quoted Airtable formula string."""
+    return str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+
+def open_cases_formula(email):
+    return f"AND({{Email}}='{escape_formula_value(email)}', {{Status}}='Open')"
+
+
+def _status(exc):
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def _is_retryable(exc):
+    """Throttling, server errors and transport failures (requests' errors are OSErrors)."""
+    status = _status(exc)
+    if status is None:
+        return isinstance(exc, OSError)
+    return status == 429 or status >= 500
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------------- Rate Limiting ---------------- #
+class RateLimiter:
+    """Thread-safe token bucket; `acquire()` blocks until a request may be sent."""
+
+    def __init__(self, rate=5.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# ---------------- Case Lookup Cache ---------------- #
+class CaseCache:
+    """Open cases per email, cached for `ttl` seconds."""
+
+    def __init__(self, table, limiter, ttl=60):
+        self.table = table
+        self.limiter = limiter
+        self.ttl = ttl
+        self._entries = {}  # email -> (cases, fetched_at)
+        self._lock = threading.Lock()
+
+    def _fetch(self, email):
+        with span("airtable.lookup") as current:
+            self.limiter.acquire()
+            cases = self.table.all(formula=open_cases_formula(email))
+            current.set(records=len(cases))
+        return cases
+
+    async def open_cases(self, email):
+        with self._lock:
+            entry = self._entries.get(email)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            current_span().set(airtable_cache_hit=True)
+            return entry[0]
+
+        cases = await asyncio.to_thread(self._fetch, email)
+        with self._lock:
+            self._entries[email] = (cases, time.monotonic())
+        return cases
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+
+# ---------------- Write-behind Queue ---------------- #
+class _PendingRecord:
+    __slots__ = ("spool_id", "fields", "future", "failures", "uncertain")
+
+    def __init__(self, spool_id, fields, uncertain=False):
+        self.spool_id = spool_id
+        self.fields = fields
+        self.future = Future()
+        self.failures = 0
+        self.uncertain = uncertain  # a create may already exist upstream
+
+
+class TicketWriter:
+    """
+    Batches record creates on a background thread.
+
+    `submit()` spools the record, queues it and returns an awaitable that
+    resolves to the created Airtable record.
+    """
+
+    def __init__(self, table, limiter, spool_path=None, window=0.2, max_retries=5,
+                 requeue_delay=60.0, max_requeues=10, on_created=None, spool_id_field=None):
+        self.table = table
+        self.limiter = limiter
+        self.spool_path = Path(spool_path or config.AIRTABLE_SPOOL_PATH)
+        self.spool_id_field = config.AIRTABLE_SPOOL_ID_FIELD if spool_id_field is None else spool_id_field
+        self.window = window
+        self.max_retries = max_retries
+        self.requeue_delay = requeue_delay
+        self.max_requeues = max_requeues
+        self.on_created = on_created
+        self._queue = queue.Queue()
+        self._spooled = {}  # spool_id -> fields, mirrors this process's spool file
+        self._spool_lock = threading.Lock()
+        self._spool_file = None  # <stem>.<pid><suffix>, chosen at start() (after any fork)
+        self._spool_owner = None  # open, locked <spool file>.lock held while the process runs
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # ---------------- Spool ---------------- #
+    # Workers never share a spool file: each rewrites only its own, and a file
+    # is replayed only by the process that owns it or adopts it after its
+    # owner died (its lock file is then free).
+    @staticmethod
+    def _lock_spool(path):
+        """Open and exclusively lock `path`.lock; None if a live process holds it."""
+        lock = open(f"{path}.lock", "a")
+        if fcntl is None:
+            return lock
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        if os.fstat(lock.fileno()).st_nlink == 0:
+            lock.close()  # another process adopted this spool while we waited
+            return None
+        return lock
+
+    @staticmethod
+    def _load_spool(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        # The previous owner may have died between the create and the spool rewrite
+        return [_PendingRecord(row["spool_id"], row["fields"], uncertain=True) for row in rows]
+
+    def _orphaned_spools(self):
+        """Spool files of other processes (plus a legacy shared spool) whose owner is gone."""
+        stem, suffix = self.spool_path.stem, self.spool_path.suffix
+        paths = [self.spool_path] + sorted(self.spool_path.parent.glob(f"{stem}.*{suffix}"))
+        return [path for path in paths if path != self._spool_file and path.exists()]
+
+    def _adopt_spools(self):
+        adopted = []
+        for path in self._orphaned_spools():
+            lock = self._lock_spool(path)
+            if lock is None:
+                continue
+            try:
+                records = self._load_spool(path)
+                with self._spool_lock:
+                    self._spooled.update((record.spool_id, record.fields) for record in records)
+                    self._write_spool()
+                # Only drop the orphan once its records are in our own spool
+                path.unlink(missing_ok=True)
+                Path(f"{path}.lock").unlink(missing_ok=True)
+            finally:
+                lock.close()
+            logger.info("Adopted %d pending ticket(s) from %s", len(records), path.name)
+            adopted.extend(records)
+        return adopted
+
+    def _write_spool(self):
+        tmp = self._spool_file.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for spool_id, fields in self._spooled.items():
+                f.write(json.dumps({"spool_id": spool_id, "fields": fields}) + "\n")
+        tmp.replace(self._spool_file)
+
+    def _append_spool(self, record):
+        with self._spool_lock:
+            self._spooled[record.spool_id] = record.fields
+            with open(self._spool_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"spool_id": record.spool_id, "fields": record.fields}) + "\n")
+
+    def _remove_spooled(self, spool_ids):
+        with self._spool_lock:
+            for spool_id in spool_ids:
+                self._spooled.pop(spool_id, None)
+            self._write_spool()
+
+    # ---------------- Worker ---------------- #
+    def start(self):
+        """Start the worker thread and requeue this process's spool plus any orphaned ones."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            stem, suffix = self.spool_path.stem, self.spool_path.suffix
+            self._spool_file = self.spool_path.with_name(f"{stem}.{os.getpid()}{suffix}")
+            self._spool_owner = self._lock_spool(self._spool_file)
+            # A file under our pid can only be left over from a dead process that had it
+            records = self._load_spool(self._spool_file)
+            self._spooled.update((record.spool_id, record.fields) for record in records)
+            records += self._adopt_spools()
+            for record in records:
+                self._queue.put(record)
+            self._thread = threading.Thread(target=self._run, name="airtable-writer", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _payload(self, record):
+        return {**record.fields, self.spool_id_field: record.spool_id} if self.spool_id_field else record.fields
+
+    def _existing(self, batch):
+        """spool_id -> Airtable record for those of `batch` that were already created."""
+        field = self.spool_id_field
+        clauses = ", ".join(f"{{{field}}}='{escape_formula_value(record.spool_id)}'" for record in batch)
+        self.limiter.acquire()
+        with span("airtable.lookup_created", records=len(batch)) as current:
+            found = self.table.all(formula=f"OR({clauses})")
+            current.set(found=len(found))
+        return {row["fields"].get(field): row for row in found}
+
+    def _create_batch(self, batch):
+        """Create `batch` without duplicates; returns the Airtable records in batch order."""
+        created = {}  # spool_id -> Airtable record
+        pending = list(batch)
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                uncertain = [record for record in pending if record.uncertain]
+                if uncertain and self.spool_id_field:
+                    created.update(self._existing(uncertain))
+                    pending = [record for record in pending if record.spool_id not in created]
+                    for record in pending:
+                        record.uncertain = False
+                if pending:
+                    self.limiter.acquire()
+                    with span("airtable.batch_create", records=len(pending), attempt=attempt):
+                        results = self.table.batch_create([self._payload(record) for record in pending])
+                    created.update(zip((record.spool_id for record in pending), results))
+                return [created[record.spool_id] for record in batch]
+            except Exception as exc:
+                if attempt == self.max_retries or not _is_retryable(exc):
+                    raise
+                if _status(exc) == 429:
+                    # Throttled requests were not processed, so they are safe to resend as is
+                    wait = _retry_after(exc) or RATE_LIMIT_LOCKOUT_S
+                else:
+                    for record in pending:
+                        record.uncertain = True
+                    wait = _retry_after(exc) or delay
+                    delay = min(delay * 2, 30.0)
+                logger.warning("Airtable create throttled/failed (%s); retrying in %.1fs", exc, wait)
+                time.sleep(wait)
+
+    def _created(self, batch, created):
+        self._remove_spooled([record.spool_id for record in batch])
+        for record, result in zip(batch, created):
+            if self.on_created:
+                self.on_created(record.fields)
+            if not record.future.done():
+                record.future.set_result(result)
+
+    def _failed(self, batch, exc):
+        # Records stay in the spool; retry them later in-process, and
+        # on the next start if they keep failing
+        logger.exception("Airtable create failed (%s); %d record(s) kept in spool", exc, len(batch))
+        retry = []
+        for record in batch:
+            if not record.future.done():
+                record.future.set_exception(exc)
+            record.failures += 1
+            if record.failures <= self.max_requeues:
+                retry.append(record)
+        if retry:
+            timer = threading.Timer(self.requeue_delay, lambda records=retry: [self._queue.put(r) for r in records])
+            timer.daemon = True
+            timer.start()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._created(batch, self._create_batch(batch))
+                continue
+            except Exception as exc:
+                if len(batch) == 1 or _is_retryable(exc):
+                    self._failed(batch, exc)
+                    continue
+                logger.warning("Airtable batch create rejected (%s); creating %d record(s) one by one", exc, len(batch))
+
+            # A non-retryable error (e.g. 422) is usually one bad record: isolate it
+            for record in batch:
+                try:
+                    self._created([record], self._create_batch([record]))
+                except Exception as exc:
+                    self._failed([record], exc)
+
+    # ---------------- Public API ---------------- #
+    def submit(self, fields):
+        """Queue a create; returns (spool_id, awaitable resolving to the created record)."""
+        self.start()
+        record = _PendingRecord(uuid.uuid4().hex[:12], fields)
+        self._append_spool(record)
+        self._queue.put(record)
+        return record.spool_id, asyncio.wrap_future(record.future)
+
+
+# ---------------- Repository ---------------- #
+class CaseRepository:
+    """Cached case lookups plus write-behind ticket creation over one Airtable table."""
+
+    def __init__(self, table, cache_ttl=None, spool_path=None, limiter=None):
+        # A rate below 1 req/s still needs a burst of one, or acquire() never succeeds
+        self.limiter = limiter or RateLimiter(
+            rate=config.AIRTABLE_RATE_LIMIT, burst=max(1, int(config.AIRTABLE_RATE_LIMIT))
+        )
+        self.cases = CaseCache(table, self.limiter, ttl=config.AIRTABLE_CACHE_TTL if cache_ttl is None else cache_ttl)
+        self.writer = TicketWriter(
+            table,
+            self.limiter,
+            spool_path=spool_path,
+            on_created=lambda fields: self.cases.invalidate(fields.get("Email"))
+        )
+
+    async def open_cases(self, email):
+        return await self.cases.open_cases(email)
+
+    def create_ticket(self, fields):
+        """Queue a ticket; returns (spool_id, awaitable record)."""
+        self.cases.invalidate(fields.get("Email"))
+        return self.writer.submit(fields)
@@ -0,0 +1,137 @@
+# workflow/batch.py
+"""
+Bulk question answering over the shared RAG engine (nightly regression
+sets, ticket triage).
+
+    python -m workflow.batch queries.jsonl answers.jsonl --concurrency 16
+
+Input lines are JSON objects with "query" (or "input" / "question"), an
+optional "id" (defaults to the line number) and an optional "category".
+Queries are retrieved BATCH_SIZE at a time through `RagEngine.batch_retrieve`
+(one embedding batch, one BM25 pass, one dense search), while answers for
+earlier blocks are generated with at most BATCH_CONCURRENCY LLM calls in
+flight. Every answer is appended to the output as soon as it finishes, so
+the output file is the checkpoint: a rerun skips ids that already have an
+answer and retries the ones that failed.
+"""
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+from src import config
+from src.tracing import span
+from src.llm_client import BACKGROUND, llm_priority
+from workflow.hybrid import doc_key
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- Input / Checkpoint ---------------- #
+def read_queries(path):
+    """[{"id", "query", "category"}, ...] from a JSONL file."""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            query = row.get("query") or row.get("input") or row.get("question") or ""
+            queries.append({"id": str(row.get("id", n)), "query": query, "category": row.get("category")})
+    return queries
+
+
+def completed_ids(path):
+    """Ids already answered in an output file from an earlier (possibly interrupted) run."""
+    done = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by the interruption
+                if "answer" in row:
+                    done.add(str(row["id"]))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+# ---------------- Runner ---------------- #
+async def _answer(engine, item, docs, slots, out, report):
+    try:
+        # Background priority: a batch sharing a process with live chat queues behind it
+        with span("batch.answer"), llm_priority(BACKGROUND):
+            stream = engine.astream_answer(item["query"], docs=docs, category=item["category"])
+            answer = "".join([token async for token in stream])
+        record = {**item, "answer": answer, "sources": [doc_key(doc) for doc in docs]}
+        report["answered"] += 1
+    except Exception as exc:
+        logger.warning("query %s failed: %s", item["id"], exc)
+        record = {**item, "error": f"{type(exc).__name__}: {exc}"}
+        report["failed"] += 1
+    finally:
+        slots.release()
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+async def arun_batch(queries, output_path, engine=None, batch_size=None, concurrency=None):
+    """Answer `queries` (see `read_queries`) into `output_path`, skipping ids it already answers."""
+    from workflow.rag import get_rag_engine
+
+    engine = engine or get_rag_engine()
+    batch_size = batch_size or config.BATCH_SIZE
+    slots = asyncio.Semaphore(concurrency or config.BATCH_CONCURRENCY)
+    done = completed_ids(output_path)
+    pending = [item for item in queries if item["id"] not in done]
+    report = {"queries": len(queries), "skipped": len(queries) - len(pending), "answered": 0, "failed": 0}
+
+    started = time.perf_counter()
+    tasks = []
+    with open(output_path, "a", encoding="utf-8") as out:
+        for start in range(0, len(pending), batch_size):
+            block = pending[start:start + batch_size]
+            # Retrieval for this block overlaps generation still running for earlier ones
+            results = await asyncio.to_thread(
+                engine.batch_retrieve, [item["query"] for item in block], [item["category"] for item in block]
+            )
+            for item, docs in zip(block, results):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(_answer(engine, item, docs, slots, out, report)))
+            tasks = [task for task in tasks if not task.done()]
+        await asyncio.gather(*tasks)
+
+    report["wall_s"] = time.perf_counter() - started
+    report["queries_per_s"] = (report["answered"] + report["failed"]) / report["wall_s"] if report["wall_s"] else 0.0
+    return report
+
+
+def run_batch(input_path, output_path, **kwargs):
+    return asyncio.run(arun_batch(read_queries(input_path), output_path, **kwargs))
+
+
+# ---------------- CLI Runner ---------------- #
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries with the RAG pipeline.")
+    parser.add_argument("input", help="JSONL with query / id / category per line")
+    parser.add_argument("output", help="JSONL answers; also the checkpoint an interrupted run resumes from")
+    parser.add_argument("--batch-size", type=int, default=config.BATCH_SIZE, help="Queries retrieved per block")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_CONCURRENCY, help="Answers generated at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s]: %(message)s:')
+
+    from workflow.rag import get_rag_engine
+    engine = get_rag_engine().warmup()
+    report = asyncio.run(arun_batch(
+        read_queries(args.input), args.output, engine=engine, batch_size=args.batch_size, concurrency=args.concurrency
+    ))
+    report["answer_cache"] = engine.cache_stats()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
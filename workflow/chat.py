@@ -0,0 +1,147 @@
+# workflow/chat.py
+"""
+Conversation routing shared by the chat backend and the CLI runners.
+
+A ChatSession holds one user's stage plus their EC/NC workflows and routes
+each message the way the Streamlit app used to. The SessionRegistry keeps
+sessions for the life of the process, evicting idle ones.
+"""
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from workflow.ec_workflow import ExistingCustomerWorkflow
+from workflow.nc_workflow import NewCustomerWorkflow
+from workflow.rag import get_rag_engine
+from src import config
+from src.tracing import span
+
+
+class ChatSession:
+    """One conversation: stage routing plus lazily created workflows."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.stage = "intro"
+        self.touched_at = time.time()
+        self._ec_workflow = None
+        self._nc_workflow = None
+        self._lock = None
+
+    @property
+    def ec_workflow(self):
+        if self._ec_workflow is None:
+            self._ec_workflow = ExistingCustomerWorkflow()
+        return self._ec_workflow
+
+    @property
+    def nc_workflow(self):
+        if self._nc_workflow is None:
+            self._nc_workflow = NewCustomerWorkflow(session_id=self.session_id)
+        return self._nc_workflow
+
+    @property
+    def lock(self):
+        # Serializes turns of one session; created on the server's event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def process_stream(self, user_input):
+        """Route the message and yield the bot response token by token."""
+        async with self.lock:
+            self.touched_at = time.time()
+            with span("turn", stage=self.stage):
+                async for token in self._route(user_input):
+                    yield token
+
+    async def process(self, user_input):
+        return "".join([token async for token in self.process_stream(user_input)])
+
+    async def _route(self, user_input):
+        stage = self.stage
+
+        # ---------------- Conversation Flow ---------------- #
+        if stage == "intro":
+            yield "Are you an existing customer or a new customer? Or do you just need general information?"
+            self.stage = "choose_flow"
+
+        elif stage == "choose_flow":
+            if "new" in user_input.lower():
+                self.stage = "new_customer"
+                async for token in self.nc_workflow.process_stream(user_input):
+                    yield token
+
+            elif "exist" in user_input.lower():
+                self.stage = "existing_customer"
+                async for token in self.ec_workflow.process_stream(user_input):
+                    yield token
+
+            elif "info" in user_input.lower() or "general" in user_input.lower():
+                yield "Here’s what I found:\n\n"
+                async for token in get_rag_engine().astream_answer(user_input):
+                    yield token
+                self.stage = "intro"  # reset after answering
+
+            else:
+                yield "Please type 'new', 'existing', or 'general information'."
+
+        elif stage == "new_customer":
+            async for token in self.nc_workflow.process_stream(user_input):
+                yield token
+
+        elif stage == "existing_customer":
+            async for token in self.ec_workflow.process_stream(user_input):
+                yield token
+
+        else:
+            yield "Sorry, I didn’t understand. Please say new, existing, or general info."
+
+
+class SessionRegistry:
+    """Process-wide ChatSessions with LRU eviction of idle sessions."""
+
+    def __init__(self, max_sessions=1000, idle_ttl=3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # session_id -> ChatSession
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ChatSession(session_id)
+            session.touched_at = now
+            self._sessions.move_to_end(session_id)
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if oldest_id == session_id:
+                    break
+                if len(self._sessions) > self.max_sessions or now - oldest.touched_at > self.idle_ttl:
+                    del self._sessions[oldest_id]
+                else:
+                    break
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SessionRegistry(config.CHAT_MAX_SESSIONS, config.CHAT_SESSION_TTL)
+    return _registry
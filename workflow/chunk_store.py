@@ -0,0 +1,255 @@
+# workflow/chunk_store.py
+"""
+On-disk cache of pre-split PDF chunks.
+
+Each PDF is parsed and split once; the resulting chunks are stored as a
+zlib-compressed JSON blob and reused until the file (or the splitter
+parameters) change. Every chunk is tagged with a `category` (from the
+category map file or the PDF's sub-directory) when the corpus is loaded.
+"""
+import os
+import json
+import zlib
+import fnmatch
+import hashlib
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+PAGE_BATCH_SIZE = 32
+CATEGORY_KEY = "category"
+
+
+# ---------------- Helpers ---------------- #
+def file_digest(path, block_size=1 << 20):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(doc):
+    """Stable id for a chunk: changes whenever its source, position or text changes."""
+    meta = doc.metadata
+    key = f"{meta.get('source')}|{meta.get('page')}|{meta.get('start_index')}|{doc.page_content}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def matches_filter(metadata, filter):
+    """Equality match of every `filter` key against `metadata`."""
+    return all(metadata.get(key) == value for key, value in filter.items())
+
+
+def load_category_map(path):
+    """Return [(glob pattern, category), ...] from a JSON object file, or [] if absent."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return list(json.load(f).items())
+    except FileNotFoundError:
+        return []
+
+
+def category_for(path, data_path, category_map=(), default=None):
+    """
+    Category of a PDF: the first category-map pattern matching its path
+    relative to `data_path` (or its file name), else its top-level
+    sub-directory under `data_path`, else `default`.
+    """
+    relative = Path(path).relative_to(data_path) if Path(path).is_relative_to(data_path) else Path(path)
+    for pattern, category in category_map:
+        if fnmatch.fnmatch(relative.as_posix(), pattern) or fnmatch.fnmatch(relative.name, pattern):
+            return category
+    if len(relative.parts) > 1:
+        return relative.parts[0]
+    return default or config.DEFAULT_CATEGORY
+
+
+def tag_categories(chunks, data_path, category_map=None):
+    """Set metadata["category"] on every chunk from its source path."""
+    if category_map is None:
+        category_map = load_category_map(config.CATEGORY_MAP_PATH or Path(data_path) / "categories.json")
+    categories = {}
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        if source not in categories:
+            categories[source] = category_for(source, data_path, category_map)
+        chunk.metadata[CATEGORY_KEY] = categories[source]
+    return chunks
+
+
+def chunk_set_fingerprint(chunks):
+    """
+    Digest of the ordered chunk ids and their categories; changes whenever
+    any chunk is added, edited, removed or retagged.
+    """
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(f"{chunk.metadata.get('chunk_id', '')}\0{chunk.metadata.get(CATEGORY_KEY) or ''}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def split_pdf(path, chunk_size=800, chunk_overlap=200, page_batch_size=PAGE_BATCH_SIZE):
+    """Parse one PDF and split its pages, a batch at a time, into id-tagged chunks."""
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True
+    )
+    chunks = []
+    batch = []
+    for page in PyPDFLoader(str(path)).lazy_load():
+        batch.append(page)
+        if len(batch) >= page_batch_size:
+            chunks.extend(splitter.split_documents(batch))
+            batch = []
+    if batch:
+        chunks.extend(splitter.split_documents(batch))
+
+    for chunk in chunks:
+        chunk.metadata["chunk_id"] = chunk_id(chunk)
+    return chunks
+
+
+def _encode(chunks):
+    payload = [[c.page_content, c.metadata] for c in chunks]
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(blob):
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return [Document(page_content=text, metadata=meta) for text, meta in payload]
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ---------------- Chunk Store ---------------- #
+class ChunkStore:
+    """
+    Persistent chunk cache keyed by file path, mtime, content hash and splitter params.
+
+    A file whose mtime and size are unchanged is served straight from its blob;
+    if only the mtime moved, the content hash decides whether it is re-parsed.
+    """
+
+    def __init__(self, cache_dir=None, chunk_size=800, chunk_overlap=200, max_workers=None):
+        self.cache_dir = Path(cache_dir or config.CHUNK_CACHE_DIR)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers
+        self.stats = {"hits": 0, "misses": 0, "removed": 0}
+
+    @property
+    def manifest_path(self):
+        return self.cache_dir / MANIFEST_NAME
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if manifest.get("version") != FORMAT_VERSION:
+            return {}
+        return manifest.get("files", {})
+
+    def _write_manifest(self, files):
+        data = json.dumps({"version": FORMAT_VERSION, "files": files}, indent=1)
+        _write_atomic(self.manifest_path, data.encode("utf-8"))
+
+    def _blob_path(self, path):
+        key = f"{path}|{self.chunk_size}|{self.chunk_overlap}"
+        return self.cache_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.bin"
+
+    def _params_match(self, entry):
+        return entry.get("chunk_size") == self.chunk_size and entry.get("chunk_overlap") == self.chunk_overlap
+
+    def _cached_chunks(self, path, stat, entry):
+        """Return cached chunks for `path` if still valid, updating `entry` in place."""
+        if not entry or not self._params_match(entry):
+            return None
+        blob_path = self.cache_dir / entry["blob"]
+        if not blob_path.exists():
+            return None
+        if entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            if entry["sha256"] != file_digest(path):
+                return None
+            entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+        with open(blob_path, "rb") as f:
+            return _decode(f.read())
+
+    def _parse_all(self, paths):
+        """Parse and split `paths`, fanning out to a process pool when there is more than one."""
+        if len(paths) <= 1 or self.max_workers == 1:
+            return [split_pdf(p, self.chunk_size, self.chunk_overlap) for p in paths]
+        n = len(paths)
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(split_pdf, paths, [self.chunk_size] * n, [self.chunk_overlap] * n))
+
+    def load(self, data_path):
+        """Load split chunks for every PDF under `data_path`, re-parsing only new or changed files."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._read_manifest()
+        files = {}
+        by_path = {}
+        stale = []
+
+        for pdf in sorted(Path(data_path).rglob("*.pdf")):
+            path = str(pdf)
+            stat = pdf.stat()
+            entry = dict(manifest.get(path) or {})
+            cached = self._cached_chunks(path, stat, entry)
+            if cached is None:
+                stale.append((path, stat, entry))
+            else:
+                self.stats["hits"] += 1
+                files[path] = entry
+                by_path[path] = cached
+
+        if stale:
+            logger.info("Parsing %d new or changed PDF(s)", len(stale))
+        parsed = self._parse_all([path for path, _, _ in stale])
+        for (path, stat, old_entry), chunks in zip(stale, parsed):
+            self.stats["misses"] += 1
+            blob_path = self._blob_path(path)
+            _write_atomic(blob_path, _encode(chunks))
+            if old_entry.get("blob") and old_entry["blob"] != blob_path.name:
+                (self.cache_dir / old_entry["blob"]).unlink(missing_ok=True)
+            files[path] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "sha256": file_digest(path),
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "blob": blob_path.name,
+            }
+            by_path[path] = chunks
+
+        # Drop blobs of files that disappeared from the corpus
+        for path, entry in manifest.items():
+            if path not in files:
+                self.stats["removed"] += 1
+                (self.cache_dir / entry["blob"]).unlink(missing_ok=True)
+
+        if files != manifest:
+            self._write_manifest(files)
+        chunks = [chunk for path in sorted(by_path) for chunk in by_path[path]]
+        # Tagged on every load (not cached), so editing the category map needs no re-parse
+        return tag_categories(chunks, data_path)
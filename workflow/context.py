@@ -0,0 +1,204 @@
+# workflow/context.py
+"""
+Context packing between retrieval and the stuff-documents chain.
+
+Retrieved chunks overlap (text_split uses a 200-character overlap) and the
+dense and sparse legs often return neighbours of the same passage. Before
+the prompt is assembled the packer:
+
+- merges adjacent / overlapping chunks from the same PDF page,
+- drops near-duplicates (word-shingle containment),
+- orders by rerank / fused score,
+- truncates to a token budget.
+
+Token counts before and after are logged per query and accumulated in
+`stats()`.
+"""
+import re
+import logging
+import threading
+
+from langchain_core.documents import Document
+
+from src.helper import count_tokens, truncate_tokens
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Separator the stuff-documents chain puts between documents
+DOCUMENT_SEPARATOR = "\n\n"
+
+# Ranking scores set upstream, most specific first
+SCORE_KEYS = ("rerank_score", "fusion_score")
+
+
+def _span(doc):
+    """(source, page, start, end) for chunks carrying a start_index, else None."""
+    start = doc.metadata.get("start_index")
+    if start is None:
+        return None
+    return doc.metadata.get("source"), doc.metadata.get("page"), start, start + len(doc.page_content)
+
+
+def merge_adjacent(docs, max_gap=0):
+    """
+    Merge chunks from the same source page whose character spans touch or
+    overlap (within `max_gap`). The merged chunk keeps the best fusion /
+    rerank score and the position of its highest-ranked part.
+    """
+    groups, order = {}, []
+    for rank, doc in enumerate(docs):
+        span = _span(doc)
+        key = (span[0], span[1]) if span else ("__unplaced__", rank)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((rank, doc))
+
+    merged = []
+    for key in order:
+        group = groups[key]
+        if key[0] == "__unplaced__" or len(group) == 1:
+            merged.extend(group)
+            continue
+
+        group.sort(key=lambda item: item[1].metadata["start_index"])
+        rank, current = group[0]
+        start, end = current.metadata["start_index"], _span(current)[3]
+        text, parts = current.page_content, [current]
+        for next_rank, doc in group[1:]:
+            next_start, next_end = doc.metadata["start_index"], _span(doc)[3]
+            if next_start <= end + max_gap:
+                if next_end > end:
+                    text += doc.page_content[max(0, end - next_start):]
+                    end = next_end
+                rank = min(rank, next_rank)
+                parts.append(doc)
+                continue
+            merged.append((rank, _merged_doc(parts, text, start)))
+            rank, current = next_rank, doc
+            start, end = next_start, next_end
+            text, parts = doc.page_content, [doc]
+        merged.append((rank, _merged_doc(parts, text, start)))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged]
+
+
+def _merged_doc(parts, text, start):
+    if len(parts) == 1:
+        return parts[0]
+    metadata = {**parts[0].metadata, "start_index": start}
+    metadata["merged_chunk_ids"] = [p.metadata.get("chunk_id") for p in parts if p.metadata.get("chunk_id")]
+    for key in SCORE_KEYS:
+        scores = [p.metadata[key] for p in parts if p.metadata.get(key) is not None]
+        if scores:
+            metadata[key] = max(scores)
+    return Document(page_content=text, metadata=metadata)
+
+
+def _shingles(text, size=3):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(docs, threshold=0.9):
+    """Drop documents whose shingles are mostly contained in an earlier kept document."""
+    kept, kept_shingles = [], []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        duplicate = any(
+            shingles and other and len(shingles & other) / min(len(shingles), len(other)) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def _score(doc):
+    for key in SCORE_KEYS:
+        if doc.metadata.get(key) is not None:
+            return doc.metadata[key]
+    return float("-inf")
+
+
+def order_by_score(docs):
+    """
+    Highest rerank score (or fused score, without the rerank stage) first;
+    unscored documents keep their retrieval order after scored ones.
+    """
+    return sorted(docs, key=lambda doc: -_score(doc))
+
+
+# ---------------- Packer ---------------- #
+class ContextPacker:
+    """Merge, dedupe, order and token-budget the retrieved context for one prompt."""
+
+    def __init__(self, token_budget=1500, dedup_threshold=0.9, max_gap=0, min_tokens=50):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.max_gap = max_gap
+        self.min_tokens = min_tokens
+        self.queries = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._lock = threading.Lock()
+
+    def _fit_budget(self, docs):
+        packed, used = [], 0
+        separator = count_tokens(DOCUMENT_SEPARATOR)
+        for doc in docs:
+            remaining = self.token_budget - used
+            if remaining < self.min_tokens:
+                break
+            tokens = count_tokens(doc.page_content)
+            if tokens > remaining:
+                doc = Document(
+                    page_content=truncate_tokens(doc.page_content, remaining),
+                    metadata={**doc.metadata, "truncated": True},
+                    id=doc.id
+                )
+                tokens = remaining
+            packed.append(doc)
+            used += tokens + separator
+        return packed
+
+    def pack(self, docs):
+        """Return the packed document list for the prompt."""
+        with span("context_pack") as current:
+            docs = list(docs)
+            tokens_in = sum(count_tokens(doc.page_content) for doc in docs)
+
+            packed = merge_adjacent(docs, self.max_gap)
+            packed = drop_near_duplicates(packed, self.dedup_threshold)
+            packed = order_by_score(packed)
+            if self.token_budget:
+                packed = self._fit_budget(packed)
+
+            tokens_out = sum(count_tokens(doc.page_content) for doc in packed)
+            current.set(docs_in=len(docs), docs_out=len(packed), tokens_in=tokens_in, tokens_out=tokens_out)
+        with self._lock:
+            self.queries += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        logger.info(
+            "context packed: %d -> %d docs, %d -> %d tokens (saved %d)",
+            len(docs), len(packed), tokens_in, tokens_out, tokens_in - tokens_out
+        )
+        return packed
+
+    def stats(self):
+        saved = self.tokens_in - self.tokens_out
+        return {
+            "queries": self.queries,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": saved,
+            "saved_per_query": saved / self.queries if self.queries else 0.0,
+        }
@@ -1,51 +1,219 @@
 # src/workflow/existing_customer.py
 import os
 import asyncio
+import logging
+import weakref
+import threading
 from src import config
-from pyairtable import Table
-from langchain_openai import ChatOpenAI
-from workflow.rag import load_pdf_file, text_split, build_rag_pipeline
-from src.memory import get_memory  # <-- import shared memory
+from src.tracing import span
+from src.llm_router import get_model_router
+from workflow.rag import get_rag_engine
+from workflow.airtable_store import CaseRepository
 
-## Rag set up
-from functools import lru_cache
+logger = logging.getLogger(__name__)
 
-@lru_cache
-def rag_chain():
-    extracted_data = load_pdf_file("Data/")
-    text_chunks = text_split(extracted_data)
-    return build_rag_pipeline(text_chunks)
+# ---------------- Airtable Setup ---------------- #
+# Created on first use rather than at import, so importing this module needs
+# neither the Airtable env vars nor the pyairtable / OpenAI clients
+_case_repository = None
+_llm_existing = None
+_init_lock = threading.Lock()
 
 
-# ---------------- Airtable Setup ---------------- #
-AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
-AIRTABLE_TABLE_NAME = os.getenv("AIRTABLE_TABLE_NAME")
-AIRTABLE_TOKEN = os.getenv("AIRTABLE_TOKEN")
+def get_case_repository():
+    """Process-wide case repository over the configured Airtable table."""
+    global _case_repository
+    if _case_repository is None:
+        with _init_lock:
+            if _case_repository is None:
+                base_id = os.getenv("AIRTABLE_BASE_ID")
+                table_name = os.getenv("AIRTABLE_TABLE_NAME")
+                token = os.getenv("AIRTABLE_TOKEN")
+                if not all([base_id, table_name, token]):
+                    raise EnvironmentError("Missing Airtable environment variables.")
 
-if not all([AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME, AIRTABLE_TOKEN]):
-    raise EnvironmentError("Missing Airtable environment variables.")
+                from pyairtable import Table
+                _case_repository = CaseRepository(Table(token, base_id, table_name))
+    return _case_repository
 
-table = Table(AIRTABLE_TOKEN, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
 
 # ---------------- LLM & RAG Setup ---------------- #
-llm_existing = ChatOpenAI(
-    model=config.LOW_LLM,
-    temperature=0.7,
-    openai_api_key=config.OPENAI_API_KEY
-)
+def get_llm_existing():
+    global _llm_existing
+    if _llm_existing is None:
+        with _init_lock:
+            if _llm_existing is None:
+                _llm_existing = get_model_router().chat_model("chat", temperature=0.7)
+    return _llm_existing
+
+
+# Bounds concurrent RAG calls; one semaphore per event loop since asyncio
+# primitives cannot be shared across loops. Background prefetches get their
+# own, smaller pool so they never hold slots an interactive turn is waiting on
+_rag_semaphores = weakref.WeakKeyDictionary()
+_prefetch_semaphores = weakref.WeakKeyDictionary()
+
+
+def _loop_semaphore(semaphores, size):
+    loop = asyncio.get_running_loop()
+    semaphore = semaphores.get(loop)
+    if semaphore is None:
+        semaphore = semaphores[loop] = asyncio.Semaphore(size)
+    return semaphore
+
+
+def _rag_slots():
+    return _loop_semaphore(_rag_semaphores, config.RAG_MAX_CONCURRENCY)
+
+
+def _prefetch_slots():
+    return _loop_semaphore(_prefetch_semaphores, config.PREFETCH_CONCURRENCY)
+
+
+def _consume_result(task):
+    # Failed prefetches fall back to a live answer; don't log them as unretrieved
+    if not task.cancelled():
+        task.exception()
 
-shared_memory = get_memory()
 
 # ---------------- Workflow Class ---------------- #
 class ExistingCustomerWorkflow:
-    def __init__(self):
+    def __init__(self, repository=None):
+        self.repository = repository or get_case_repository()
         self.stage = "ask_email"
         self.customer_email = None
         self.open_cases = []
+        self._prefetched = {}  # case index -> task resolving to the suggested solution
+        self._prefetch_running = set()  # prefetch tasks that hold a slot (no longer queued)
+
+    async def stream_rag_answer(self, query, category=None):
+        """
+        Stream a knowledge-base answer without blocking the event loop.
+
+        Retrieval is restricted to `category` when the knowledge base has it.
+        At most RAG_MAX_CONCURRENCY answers run at once per loop, and the whole
+        answer must arrive within RAG_TIMEOUT_S.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.RAG_TIMEOUT_S
+        empty = True
+        async with _rag_slots():
+            stream = get_rag_engine().astream_answer(query, category=category)
+            try:
+                while True:
+                    remaining = max(0.0, deadline - loop.time())
+                    token = await asyncio.wait_for(anext(stream), remaining)
+                    empty = False
+                    yield token
+            except StopAsyncIteration:
+                pass
+            except asyncio.TimeoutError:
+                empty = False
+                yield "Sorry, the knowledge base is taking too long to respond. Please try again in a moment."
+            finally:
+                await stream.aclose()
+        if empty:
+            yield "Sorry, I could not find relevant information."
+
+    async def fetch_rag_answer(self, query, category=None):
+        return "".join([token async for token in self.stream_rag_answer(query, category)])
+
+    # ---------------- Case Prefetch ---------------- #
+    async def _prefetch_answer(self, index, query, category=None):
+        from src.llm_client import BACKGROUND, llm_priority  # httpx; only needed once a prefetch runs
 
-    async def fetch_rag_answer(self, query):
-        docs = rag_chain().invoke({"input": query})
-        return docs if docs else "Sorry, I could not find relevant information."
+        async with _prefetch_slots():
+            self._prefetch_running.add(asyncio.current_task())
+            # Queued behind interactive turns by the shared OpenAI rate limiter
+            with span("ec.prefetch", case=index), llm_priority(BACKGROUND):
+                stream = get_rag_engine().astream_answer(query, category=category)
+                return await asyncio.wait_for(self._join(stream), config.RAG_TIMEOUT_S)
+
+    @staticmethod
+    async def _join(stream):
+        return "".join([token async for token in stream])
+
+    def start_prefetch(self, cases):
+        """Start suggested-solution answers for the listed cases in the background."""
+        self.cancel_prefetch()
+        if not config.PREFETCH_ENABLED:
+            return
+        for index, case in enumerate(cases[:config.PREFETCH_MAX_CASES]):
+            description = case["fields"].get("Description", "")
+            if description:
+                task = asyncio.create_task(self._prefetch_answer(index, description, case["fields"].get("Category")))
+                task.add_done_callback(_consume_result)
+                self._prefetched[index] = task
+
+    def cancel_prefetch(self, keep=None):
+        """Cancel every prefetch except the one for case `keep`."""
+        for index, task in self._prefetched.items():
+            if index != keep:
+                task.cancel()
+                self._prefetch_running.discard(task)
+        self._prefetched = {keep: self._prefetched[keep]} if keep in self._prefetched else {}
+
+    async def prefetched_answer(self, index, timeout=None):
+        """
+        The prefetched answer for case `index`, or None to answer live. A
+        prefetch still queued for a slot is dropped; a running one is awaited
+        for at most `timeout` seconds, since a live answer starts streaming
+        sooner than a queued or half-done prefetch completes.
+        """
+        task = self._prefetched.get(index)
+        if task is None or task.cancelled():
+            return None
+        if not task.done() and task not in self._prefetch_running:
+            task.cancel()
+            return None
+        try:
+            # Shielded so an abandoned turn doesn't throw away the prefetch
+            answer = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            logger.info("prefetch for case %d still running after %.1fs; answering live", index + 1, timeout)
+            task.cancel()
+            return None
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return None
+            raise
+        except Exception:
+            logger.warning("prefetch for case %d failed; answering live", index + 1, exc_info=True)
+            return None
+        return answer or None
+
+    async def process_stream(self, user_input):
+        """Yield the response for `user_input`, streaming knowledge-base answers token by token."""
+        if self.stage == "select_case_number":
+            try:
+                case_num = int(user_input.strip().lower()) - 1
+                chosen_case = self.open_cases[case_num]
+            except (ValueError, IndexError):
+                yield "Invalid case number. Please enter a valid number."
+                return
+            yield f"Case Details:\n{chosen_case['fields'].get('Description', 'No Description')}\n\nSuggested solution:\n"
+            # The other cases' prefetches would only compete with this answer now
+            self.cancel_prefetch(keep=case_num)
+            answer = await self.prefetched_answer(case_num, config.PREFETCH_WAIT_S)
+            if answer is not None:
+                yield answer
+            else:
+                fields = chosen_case["fields"]
+                async for token in self.stream_rag_answer(fields.get("Description", ""), fields.get("Category")):
+                    yield token
+            self.cancel_prefetch()
+            self.stage = "assist_case"
+
+        elif self.stage == "wait_issue_desc":
+            self.issue_desc = user_input.strip().lower()
+            yield "Suggested information from knowledge base:\n"
+            async for token in self.stream_rag_answer(self.issue_desc, self.category_choice):
+                yield token
+            yield "\nDo you want to create a ticket for this? (yes/no)"
+            self.stage = "confirm_ticket"
+
+        else:
+            yield (await self.process(user_input))["answer"]
 
     async def process(self, user_input):
         user_input = user_input.strip().lower()
@@ -58,11 +226,12 @@ class ExistingCustomerWorkflow:
 
         elif self.stage == "wait_email":
             self.customer_email = user_input
-            self.open_cases = table.all(formula=f"AND({{Email}}='{self.customer_email}', {{Status}}='Open')")
+            self.open_cases = await self.repository.open_cases(self.customer_email)
             if self.open_cases:
                 case_list = "\n".join(f"{idx+1}. {case['fields'].get('Case Title', 'No Title')}"
                                       for idx, case in enumerate(self.open_cases))
                 response = f"I found these open cases:\n{case_list}\nWould you like help with one of these cases?"
+                self.start_prefetch(self.open_cases)
                 self.stage = "help_existing_case"
             else:
                 response = "No open cases found. Please choose a category:\n1. Billing\n2. Software\n3. Hardware\n4. Partner"
@@ -74,19 +243,13 @@ class ExistingCustomerWorkflow:
                 response = "Which case number would you like help with?"
                 self.stage = "select_case_number"
             else:
+                self.cancel_prefetch()
                 response = "Please choose a category instead:\n1. Billing\n2. Software\n3. Hardware\n4. Partner"
                 self.stage = "choose_category"
             return {"answer": response}
 
         elif self.stage == "select_case_number":
-            try:
-                case_num = int(user_input) - 1
-                chosen_case = self.open_cases[case_num]
-                rag_answer = await self.fetch_rag_answer(chosen_case["fields"].get("Description", ""))
-                response = f"Case Details:\n{chosen_case['fields'].get('Description', 'No Description')}\n\nSuggested solution:\n{rag_answer}"
-                self.stage = "assist_case"
-            except (ValueError, IndexError):
-                response = "Invalid case number. Please enter a valid number."
+            response = "".join([token async for token in self.process_stream(user_input)])
             return {"answer": response}
 
         elif self.stage == "choose_category":
@@ -101,23 +264,31 @@ class ExistingCustomerWorkflow:
             return {"answer": response}
 
         elif self.stage == "wait_issue_desc":
-            self.issue_desc = user_input
-            rag_answer = await self.fetch_rag_answer(self.issue_desc)
-            response = f"Suggested information from knowledge base:\n{rag_answer}\nDo you want to create a ticket for this? (yes/no)"
-            self.stage = "confirm_ticket"
+            response = "".join([token async for token in self.process_stream(user_input)])
             return {"answer": response}
 
         elif self.stage == "confirm_ticket":
             if user_input in ["yes", "y"]:
-                record = table.create({
+                spool_id, pending = self.repository.create_ticket({
                     "Email": self.customer_email,
                     "Category": self.category_choice,
                     "Case Title": f"New {self.category_choice} Issue",
                     "Description": self.issue_desc,
                     "Status": "Open"
                 })
-                ticket_id = record["id"]
-                response = f"Your ticket number is: TKT-{ticket_id}"
+                try:
+                    record = await asyncio.wait_for(asyncio.shield(pending), config.AIRTABLE_WRITE_WAIT_S)
+                    response = f"Your ticket number is: TKT-{record['id']}"
+                except asyncio.TimeoutError:
+                    response = (
+                        f"Your ticket is being created (reference: REF-{spool_id}). "
+                        "Our support team will follow up by email."
+                    )
+                except Exception:
+                    response = (
+                        f"We couldn't reach our ticketing system just now, but your request is saved "
+                        f"(reference: REF-{spool_id}) and will be submitted automatically."
+                    )
             else:
                 response = "Ticket not created."
             self.stage = "done"
@@ -0,0 +1,224 @@
+# workflow/embeddings.py
+"""
+Caching, micro-batching wrapper around an Embeddings client.
+
+Lookups go memory (LRU + TTL) -> SQLite disk tier -> API. Concurrent
+`embed_query` misses arriving within a short window are coalesced into a
+single `embed_documents` request.
+"""
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from src import config
+from src.tracing import span
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different queries share a cache entry."""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(text, model_name):
+    return hashlib.sha1(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+# ---------------- Cache Tiers ---------------- #
+class EmbeddingCache:
+    """In-memory LRU + TTL cache with an optional persistent SQLite tier."""
+
+    def __init__(self, max_size=10_000, ttl=None, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (vector, stored_at)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, stored_at REAL)"
+            )
+            self._db.commit()
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys found in either tier."""
+        now = time.time()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or self._expired(entry[1], now):
+                    missing.append(key)
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[0]
+
+            rows = []
+            if self._db is not None:
+                # SQLite caps bound parameters per statement, so look up in slices
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows.extend(self._db.execute(
+                        f"SELECT key, vector, stored_at FROM embeddings WHERE key IN ({placeholders})", part
+                    ).fetchall())
+            for key, blob, stored_at in rows:
+                if self._expired(stored_at, now):
+                    continue
+                vector = array.array("f", blob).tolist()
+                found[key] = vector
+                self._put_memory(key, vector, stored_at)
+        return found
+
+    def put_many(self, items):
+        """Store {key: vector} in both tiers."""
+        now = time.time()
+        with self._lock:
+            for key, vector in items.items():
+                self._put_memory(key, vector, now)
+            if self._db is not None and items:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                    [(key, array.array("f", vector).tobytes(), now) for key, vector in items.items()]
+                )
+                self._db.commit()
+
+    def _put_memory(self, key, vector, stored_at):
+        self._entries[key] = (vector, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# ---------------- Micro-batcher ---------------- #
+class _Pending:
+    __slots__ = ("text", "event", "result", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-text calls into batched calls of `fn(texts)`.
+
+    The first caller in a window becomes the leader: it waits `window` seconds
+    for others to join, then issues one batched request for everyone.
+    """
+
+    def __init__(self, fn, window=0.005, max_batch_size=64):
+        self.fn = fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._leader_active = False
+        self._lock = threading.Lock()
+
+    def submit(self, text):
+        item = _Pending(text)
+        with self._lock:
+            self._pending.append(item)
+            is_leader = not self._leader_active
+            self._leader_active = True
+
+        if is_leader:
+            if self.window:
+                time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leader_active = False
+            for i in range(0, len(batch), self.max_batch_size):
+                self._run(batch[i:i + self.max_batch_size])
+
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _run(self, batch):
+        unique = list(dict.fromkeys(item.text for item in batch))
+        try:
+            vectors = dict(zip(unique, self.fn(unique)))
+            for item in batch:
+                item.result = vectors[item.text]
+        except Exception as exc:
+            for item in batch:
+                item.error = exc
+        finally:
+            for item in batch:
+                item.event.set()
+
+
+# ---------------- Embeddings Wrapper ---------------- #
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper adding a two-tier cache and query micro-batching."""
+
+    def __init__(self, underlying, model_name, cache=None, batch_window=0.005, max_batch_size=64):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+        self.stats = {"hits": 0, "misses": 0, "api_calls": 0}
+        self._batcher = MicroBatcher(self._embed_uncached, window=batch_window, max_batch_size=max_batch_size)
+
+    def _count(self, **deltas):
+        # Bumped from request threads and the micro-batcher leader alike
+        with self.cache._lock:
+            for name, delta in deltas.items():
+                self.stats[name] += delta
+
+    def _embed_uncached(self, texts):
+        self._count(api_calls=1)
+        vectors = self.underlying.embed_documents(texts)
+        self.cache.put_many({cache_key(t, self.model_name): v for t, v in zip(texts, vectors)})
+        return vectors
+
+    def embed_documents(self, texts):
+        with span("embedding", texts=len(texts)) as current:
+            keys = [cache_key(t, self.model_name) for t in texts]
+            found = self.cache.get_many(keys)
+            misses = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in found))
+            self._count(hits=len(texts) - len(misses), misses=len(misses))
+            current.set(cache_hits=len(texts) - len(misses), cache_misses=len(misses))
+            if misses:
+                for text, vector in zip(misses, self._embed_uncached(misses)):
+                    found[cache_key(text, self.model_name)] = vector
+            return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        with span("embedding", texts=1) as current:
+            key = cache_key(text, self.model_name)
+            found = self.cache.get_many([key])
+            current.set(cache_hit=key in found)
+            if key in found:
+                self._count(hits=1)
+                return found[key]
+            self._count(misses=1)
+            return self._batcher.submit(text)
+
+
+def cached_openai_embeddings(model=None):
+    """OpenAIEmbeddings (on the shared HTTP pool) behind the configured memory + disk cache."""
+    from langchain_openai import OpenAIEmbeddings
+    from src.llm_client import openai_client_kwargs
+
+    model = model or config.EMBEDDING_MODEL
+    cache = EmbeddingCache(
+        max_size=config.EMBEDDING_CACHE_SIZE,
+        ttl=config.EMBEDDING_CACHE_TTL,
+        path=config.EMBEDDING_CACHE_PATH or None
+    )
+    return CachedEmbeddings(OpenAIEmbeddings(model=model, **openai_client_kwargs()), model_name=model, cache=cache)
@@ -0,0 +1,232 @@
+# workflow/hybrid.py
+"""
+Hybrid dense + sparse retriever.
+
+Both legs run concurrently (one thread pool per leg for sync calls, asyncio
+for async calls) under per-leg timeouts, so a slow dense call degrades the
+turn to sparse-only results instead of stalling it. Results are deduplicated by
+chunk id and fused with weighted reciprocal rank fusion in NumPy. A
+metadata `filter` passed to `invoke` is forwarded to every leg.
+
+`batch_retrieve` serves many queries per leg call: one embedding request and
+one batched dense search (or bounded concurrent vector-store calls), and one
+BM25 scoring pass.
+"""
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_executors = {}  # leg name -> ThreadPoolExecutor
+_executors_lock = threading.Lock()
+
+
+def leg_executor(name):
+    """
+    Thread pool for one leg. Calls that outlive their timeout keep their
+    worker, so each leg gets its own pool: a hanging dense store can only
+    back up dense calls, never the sparse fallback.
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(max_workers=16, thread_name_prefix=f"retrieval-{name}")
+    return executor
+
+
+def doc_key(doc):
+    """Identity used for dedup: chunk id when present, else the text itself."""
+    return doc.metadata.get("chunk_id") or doc.id or doc.page_content
+
+
+def fuse(results, weights, c=60):
+    """
+    Weighted reciprocal rank fusion of per-leg result lists.
+
+    Returns new Documents (metadata copied) ordered by fused score, with the
+    score stored under metadata["fusion_score"].
+    """
+    keys, scores, first_doc = [], [], {}
+    for docs, weight in zip(results, weights):
+        for rank, doc in enumerate(docs):
+            key = doc_key(doc)
+            keys.append(key)
+            scores.append(weight / (c + rank + 1))
+            first_doc.setdefault(key, doc)
+    if not keys:
+        return []
+
+    unique, inverse = np.unique(np.array(keys, dtype=object), return_inverse=True)
+    fused = np.bincount(inverse, weights=np.array(scores, dtype=np.float64))
+    order = np.argsort(-fused, kind="stable")
+    return [
+        Document(
+            page_content=first_doc[unique[i]].page_content,
+            metadata={**first_doc[unique[i]].metadata, "fusion_score": float(fused[i])},
+            id=first_doc[unique[i]].id
+        )
+        for i in order
+    ]
+
+
+class LegStats:
+    """Rolling latency window and failure counters for one retrieval leg."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+        self.timeouts = 0
+        self.errors = 0
+
+    def summary(self):
+        values = np.array(self.latencies, dtype=np.float64) * 1000.0
+        summary = {"count": len(values), "timeouts": self.timeouts, "errors": self.errors}
+        if len(values):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary.update({"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "last_ms": float(values[-1])})
+        return summary
+
+
+# ---------------- Hybrid Retriever ---------------- #
+class HybridRetriever(BaseRetriever):
+    """Concurrent, timeout-bounded replacement for EnsembleRetriever."""
+
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    names: List[str]
+    timeouts: List[Optional[float]]
+    c: int = 60
+
+    _stats: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context):
+        self._stats = {name: LegStats() for name in self.names}
+
+    def leg_latency(self):
+        """Per-leg latency percentiles (ms) and timeout/error counts."""
+        return {name: stats.summary() for name, stats in self._stats.items()}
+
+    def _record(self, name, started):
+        self._stats[name].latencies.append(time.perf_counter() - started)
+
+    def _run_leg(self, name, retriever, query, config, search_kwargs):
+        with span(f"retrieval.{name}") as current:
+            started = time.perf_counter()
+            docs = retriever.invoke(query, config, **search_kwargs)
+            self._record(name, started)
+            current.set(docs=len(docs))
+        return docs
+
+    def _get_relevant_documents(self, query, *, run_manager, filter=None):
+        config = {"callbacks": run_manager.get_child()}
+        search_kwargs = {"filter": filter} if filter else {}
+        started = time.monotonic()
+        # Each leg runs in a copy of this context so its span nests under the turn
+        futures = [
+            leg_executor(name).submit(
+                contextvars.copy_context().run, self._run_leg, name, retriever, query, config, search_kwargs
+            )
+            for name, retriever in zip(self.names, self.retrievers)
+        ]
+
+        results = []
+        for name, future, timeout in zip(self.names, futures, self.timeouts):
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            try:
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                self._stats[name].timeouts += 1
+                logger.warning("%s retrieval timed out after %.2fs; continuing without it", name, timeout)
+                results.append([])
+            except Exception:
+                self._stats[name].errors += 1
+                logger.exception("%s retrieval failed; continuing without it", name)
+                results.append([])
+        with span("fusion", candidates=sum(len(docs) for docs in results)):
+            return fuse(results, self.weights, self.c)
+
+    async def _arun_leg(self, name, retriever, query, config, timeout, search_kwargs):
+        with span(f"retrieval.{name}") as current:
+            started = time.perf_counter()
+            try:
+                docs = await asyncio.wait_for(retriever.ainvoke(query, config, **search_kwargs), timeout)
+            except asyncio.TimeoutError:
+                self._stats[name].timeouts += 1
+                current.set(timed_out=True)
+                logger.warning("%s retrieval timed out after %.2fs; continuing without it", name, timeout)
+                return []
+            except Exception:
+                self._stats[name].errors += 1
+                current.set(failed=True)
+                logger.exception("%s retrieval failed; continuing without it", name)
+                return []
+            self._record(name, started)
+            current.set(docs=len(docs))
+            return docs
+
+    # ---------------- Batch ---------------- #
+    def _batch_leg(self, name, retriever, queries, filters):
+        with span(f"retrieval.{name}.batch", queries=len(queries)):
+            if hasattr(retriever, "search_batch"):
+                return retriever.search_batch(queries, filters)
+
+            vectorstore = getattr(retriever, "vectorstore", None)
+            if vectorstore is None:
+                with ThreadPoolExecutor(max_workers=16, thread_name_prefix=f"batch-{name}") as pool:
+                    return list(pool.map(
+                        lambda q, f: retriever.invoke(q, **({"filter": f} if f else {})), queries, filters
+                    ))
+
+            # Dense: one embedding request for every query, then one batched search
+            k = retriever.search_kwargs.get("k", 4)
+            vectors = vectorstore.embeddings.embed_documents(list(queries))
+            if hasattr(vectorstore, "similarity_search_by_vectors"):
+                return [[doc for doc, _ in hits] for hits in vectorstore.similarity_search_by_vectors(vectors, k, filters)]
+            with ThreadPoolExecutor(max_workers=16, thread_name_prefix=f"batch-{name}") as pool:
+                return list(pool.map(
+                    lambda v, f: vectorstore.similarity_search_by_vector(v, k=k, **({"filter": f} if f else {})),
+                    vectors, filters
+                ))
+
+    def batch_retrieve(self, queries, filters=None):
+        """Fused results for every query; `filters[i]` applies to query i. Legs run concurrently."""
+        queries = list(queries)
+        filters = list(filters) if filters is not None else [None] * len(queries)
+        futures = [
+            leg_executor(name).submit(contextvars.copy_context().run, self._batch_leg, name, retriever, queries, filters)
+            for name, retriever in zip(self.names, self.retrievers)
+        ]
+        results = []
+        for name, future in zip(self.names, futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                self._stats[name].errors += 1
+                logger.exception("%s batch retrieval failed; continuing without it", name)
+                results.append([[] for _ in queries])
+        with span("fusion.batch", queries=len(queries)):
+            return [fuse([leg[i] for leg in results], self.weights, self.c) for i in range(len(queries))]
+
+    async def _aget_relevant_documents(self, query, *, run_manager, filter=None):
+        config = {"callbacks": run_manager.get_child()}
+        search_kwargs = {"filter": filter} if filter else {}
+        results = await asyncio.gather(*(
+            self._arun_leg(name, retriever, query, config, timeout, search_kwargs)
+            for name, retriever, timeout in zip(self.names, self.retrievers, self.timeouts)
+        ))
+        with span("fusion", candidates=sum(len(docs) for docs in results)):
+            return fuse(results, self.weights, self.c)
@@ -0,0 +1,149 @@
+# workflow/ingest.py
+"""
+Incremental ingestion of the PDF knowledge base into a vector store.
+
+PDFs are parsed in a process pool through the chunk store, and chunks are
+diffed by id against the ingest manifest so only added / changed / deleted
+chunks are embedded and written. Any LangChain VectorStore that supports
+`add_documents(ids=...)` and `delete(ids=...)` works as a target, e.g.
+`InMemoryVectorStore` for local testing.
+"""
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+
+from src import config
+from src.llm_client import BACKGROUND, llm_priority
+from workflow.chunk_store import CATEGORY_KEY, ChunkStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "ingest_manifest_{backend}.json"
+
+
+# ---------------- Manifest ---------------- #
+def read_manifest(path):
+    """Return {source: {chunk_id: category}} for what the vector store currently holds."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(path, manifest):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def diff_chunks(chunks, manifest):
+    """
+    Compare current chunks to the manifest.
+
+    A chunk whose category changed is re-upserted so the store's metadata
+    (used for filtered search) follows the category map. Manifests written
+    before categories existed list bare ids, which count as uncategorized.
+
+    Returns (added_docs, deleted_ids, new_manifest).
+    """
+    new_manifest = {}
+    by_id = {}
+    for chunk in chunks:
+        cid = chunk.metadata["chunk_id"]
+        by_id[cid] = chunk
+        new_manifest.setdefault(chunk.metadata.get("source", ""), {})[cid] = chunk.metadata.get(CATEGORY_KEY)
+
+    old = {}
+    for ids in manifest.values():
+        old.update(ids if isinstance(ids, dict) else dict.fromkeys(ids))
+    added = [
+        doc for cid, doc in by_id.items()
+        if cid not in old or old[cid] != doc.metadata.get(CATEGORY_KEY)
+    ]
+    deleted = sorted(old.keys() - by_id.keys())
+    return added, deleted, new_manifest
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# ---------------- Ingestion ---------------- #
+def ingest(vector_store, data_path=None, manifest_path=None, batch_size=100,
+           max_workers=None, dry_run=False):
+    """
+    Sync `vector_store` with the PDFs in `data_path`.
+
+    Upserts are applied before deletes and the manifest is written last, so
+    an interrupted run is safely repeated (ids make upserts idempotent).
+    """
+    data_path = data_path or config.DATA_PATH
+    if manifest_path is None:
+        manifest_path = Path(config.CHUNK_CACHE_DIR) / MANIFEST_NAME.format(backend=config.VECTOR_BACKEND)
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+    store = ChunkStore(max_workers=max_workers)
+    chunks = store.load(data_path)
+    manifest = read_manifest(manifest_path)
+    added, deleted, new_manifest = diff_chunks(chunks, manifest)
+
+    report = {
+        "files": len(new_manifest),
+        "chunks": len(chunks),
+        "added": len(added),
+        "deleted": len(deleted),
+        "parsed_files": store.stats["misses"],
+    }
+    if dry_run:
+        return report
+
+    # Embedding calls yield to interactive traffic sharing the OpenAI rate limits
+    with llm_priority(BACKGROUND):
+        for batch in _batches(added, batch_size):
+            vector_store.add_documents(batch, ids=[doc.metadata["chunk_id"] for doc in batch])
+            logger.info("Upserted %d chunk(s)", len(batch))
+
+    for batch in _batches(deleted, batch_size):
+        vector_store.delete(ids=batch)
+        logger.info("Deleted %d chunk(s)", len(batch))
+
+    # Stores that buffer writes (LocalVectorIndex) persist once, not per batch
+    if callable(getattr(vector_store, "save", None)):
+        vector_store.save()
+
+    write_manifest(manifest_path, new_manifest)
+    return report
+
+
+# ---------------- CLI Runner ---------------- #
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally ingest PDFs into the vector store.")
+    parser.add_argument("--data", default=config.DATA_PATH, help="Directory containing the PDFs")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the diff")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s]: %(message)s:')
+
+    from workflow.rag import build_rag_clients
+    _, _, dense_vector = build_rag_clients()
+
+    report = ingest(
+        dense_vector,
+        data_path=args.data,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+        dry_run=args.dry_run
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# workflow/intent.py
+"""
+Cheap local intent pre-classifier for the new-customer workflow.
+
+Combines a keyword signal with nearest-centroid classification over
+embeddings of a few labeled examples. It only returns a label when the
+margin between the two classes is clear; otherwise the caller falls back to
+the LLM intent chain.
+"""
+import re
+import threading
+
+import numpy as np
+
+RAG_QUERY = "rag_query"
+ONBOARDING_FLOW = "onboarding_flow"
+
+LABELED_EXAMPLES = {
+    RAG_QUERY: [
+        "What is RemoteLock?",
+        "How do I reset my lock?",
+        "Does RemoteLock work with Schlage locks?",
+        "How much does RemoteLock cost?",
+        "Can I issue access codes remotely?",
+        "What happens if the WiFi goes down?",
+        "Which integrations do you support?",
+        "How do I change the batteries on my lock?",
+        "Is there a mobile app?",
+        "How do guests receive their access code?",
+    ],
+    ONBOARDING_FLOW: [
+        "yes",
+        "no, we don't have any locks yet",
+        "We use Yale locks",
+        "Schlage",
+        "It's a vacation rental",
+        "small office",
+        "about 40 doors",
+        "12",
+        "sure, let's talk to sales",
+        "My name is Sarah",
+        "I'm a new customer",
+        "okay sounds good",
+    ],
+}
+
+_QUESTION_RE = re.compile(
+    r"\?\s*$|^(what|how|why|when|where|which|who|does|do|can|could|is|are|will|should)\b",
+    re.IGNORECASE
+)
+_REPLY_RE = re.compile(
+    r"^(yes|yeah|yep|no|nope|sure|ok|okay|fine|great|thanks|let'?s|my name|i'?m|we (use|have|are))\b|^\d+\b",
+    re.IGNORECASE
+)
+
+
+def keyword_score(text):
+    """Positive leans rag_query, negative leans onboarding_flow, 0 is no signal."""
+    text = text.strip()
+    score = 0.0
+    if _QUESTION_RE.search(text):
+        score += 1.0
+    if _REPLY_RE.search(text):
+        score -= 1.0
+    if len(text.split()) <= 3 and not text.endswith("?"):
+        score -= 0.5
+    return score
+
+
+class LocalIntentClassifier:
+    """
+    Nearest-centroid + keyword intent classifier.
+
+    `classify()` returns (label, confident). Centroids are embedded lazily on
+    first use through the (cached) embeddings client.
+    """
+
+    def __init__(self, embeddings, examples=None, margin=0.05, keyword_weight=0.04):
+        self.embeddings = embeddings
+        self.examples = examples or LABELED_EXAMPLES
+        self.margin = margin
+        self.keyword_weight = keyword_weight
+        self._labels = None
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _ensure_centroids(self):
+        if self._centroids is not None:
+            return
+        with self._lock:
+            if self._centroids is not None:
+                return
+            labels, centroids = [], []
+            for label, texts in self.examples.items():
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                centroid = vectors.mean(axis=0)
+                labels.append(label)
+                centroids.append(centroid / np.linalg.norm(centroid))
+            self._labels = labels
+            self._centroids = np.stack(centroids)
+
+    def classify(self, text):
+        self._ensure_centroids()
+        query = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        sims = dict(zip(self._labels, self._centroids @ query))
+
+        # Positive margin favours rag_query
+        margin = float(sims[RAG_QUERY] - sims[ONBOARDING_FLOW]) + self.keyword_weight * keyword_score(text)
+        label = RAG_QUERY if margin > 0 else ONBOARDING_FLOW
+        return label, abs(margin) >= self.margin
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier(embeddings):
+    """Process-wide classifier, so centroids are embedded once rather than per session."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = LocalIntentClassifier(embeddings)
+    return _classifier
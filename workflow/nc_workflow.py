@@ -1,32 +1,24 @@
 import asyncio
 from src import config
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema.output_parser import StrOutputParser
-from workflow.rag import load_pdf_file, text_split, build_rag_pipeline
-from src.memory import get_memory  # <-- import shared memory
-
-## Rag set up
-from functools import lru_cache
-
-@lru_cache
-def rag_chain():
-    extracted_data = load_pdf_file("Data/")
-    text_chunks = text_split(extracted_data)
-    return build_rag_pipeline(text_chunks)
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from workflow.rag import get_rag_engine
+from workflow.intent import get_local_classifier
+from src.memory import get_memory
+from src.llm_router import get_model_router
+from src.helper import count_tokens
+from src.tracing import span
 
 
 class NewCustomerWorkflow:
-    def __init__(self):
-        # Shared memory
-        self.memory = get_memory()
-
-        # LLM
-        self.low_llm = ChatOpenAI(
-            model=config.LOW_LLM,
-            temperature=0.7,
-            openai_api_key=config.OPENAI_API_KEY
-        )
+    def __init__(self, session_id="default"):
+        # Per-session memory
+        self.memory = get_memory(session_id)
+
+        # LLMs (routed per call; the shared clients are created on first use)
+        router = get_model_router()
+        self.low_llm = router.chat_model("onboarding", temperature=0.7)
+        self.intent_llm = router.chat_model("intent", temperature=0.7)
 
         # ---------------- Onboarding Chain ---------------- #
         onboarding_prompt = ChatPromptTemplate.from_messages([
@@ -80,35 +72,78 @@ Output only one label.
                 "input": lambda x: x["input"]
             }
             | intent_prompt
-            | self.low_llm
+            | self.intent_llm
             | StrOutputParser()
         )
 
-    # ---------------- Public Method ---------------- #
-    async def process(self, user_input: str) -> dict:
-        """Process user input and return bot response"""
-        intent = await self.intent_chain.ainvoke({"input": user_input})
+    # ---------------- Speculative Routing ---------------- #
+    async def _speculative_route(self, user_input: str):
+        """
+        Start retrieval and the LLM intent classifier while classifying intent
+        locally. A confident local label cancels the LLM call; otherwise its
+        label is used. Unused retrieval is cancelled.
+        """
+        engine = get_rag_engine()
+        local_intent = get_local_classifier(engine.embeddings)
+
+        retrieval = asyncio.create_task(engine.aretrieve(user_input))
+        llm_intent = asyncio.create_task(self._classify_intent(user_input))
+        try:
+            with span("intent.local") as current:
+                intent, confident = await asyncio.to_thread(local_intent.classify, user_input)
+                current.set(label=intent, confident=confident)
+            if confident:
+                llm_intent.cancel()
+            else:
+                intent = await llm_intent
+        except BaseException:
+            retrieval.cancel()
+            llm_intent.cancel()
+            raise
 
         if intent == "rag_query":
-            response = await rag_chain().ainvoke({"input": user_input})
-        else:
-            response = await self.onboarding_chain.ainvoke({"input": user_input})
-            # Extract plain text (handle dict/structured output)
-        if isinstance(response, dict):
-            response = (
-                response.get("answer") or
-                response.get("output") or
-                response.get("text") or
-                str(response)
-            )
+            return engine.astream_answer(user_input, docs=await retrieval)
+
+        retrieval.cancel()
+        return self._stream_onboarding(user_input)
+
+    async def _classify_intent(self, user_input: str):
+        with span("intent.llm") as current:
+            intent = await self.intent_chain.ainvoke({"input": user_input})
+            current.set(label=intent)
+        return intent
+
+    async def _stream_onboarding(self, user_input: str):
+        with span("llm", chain="onboarding") as current:
+            response = ""
+            async for token in self.onboarding_chain.astream({"input": user_input}):
+                response += token
+                yield token
+            current.set(output_tokens=count_tokens(response))
+
+    # ---------------- Public Methods ---------------- #
+    async def process_stream(self, user_input: str):
+        """Process user input and yield the bot response token by token"""
+        if config.SPECULATIVE_INTENT:
+            stream = await self._speculative_route(user_input)
         else:
-            response = str(response)
+            intent = await self._classify_intent(user_input)
+            if intent == "rag_query":
+                stream = get_rag_engine().astream_answer(user_input)
+            else:
+                stream = self._stream_onboarding(user_input)
 
+        response = ""
+        async for token in stream:
+            response += token
+            yield token
 
-        # Save to shared memory
-        self.memory.chat_memory.add_user_message(user_input)
-        self.memory.chat_memory.add_ai_message(response)
+        # Save to session memory
+        await self.memory.asave_turn(user_input, response)
 
+    async def process(self, user_input: str) -> dict:
+        """Process user input and return bot response"""
+        response = "".join([token async for token in self.process_stream(user_input)])
         return {"answer": response}
 
 
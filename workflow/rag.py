@@ -1,25 +1,37 @@
 # rag_pipeline.py
 
 import os
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv
 
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_pinecone import PineconeVectorStore
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
-from langchain.prompts import PromptTemplate
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+from src import config
+from src.helper import count_tokens
+from src.tracing import span
+from src.llm_router import get_model_router
+from workflow.chunk_store import CATEGORY_KEY, ChunkStore, chunk_set_fingerprint
+from workflow.embeddings import cached_openai_embeddings
+from workflow.vector_index import LocalVectorIndex
+from workflow.sparse_index import SparseIndexRetriever
+from workflow.hybrid import HybridRetriever, doc_key
+from workflow.semantic_cache import SemanticCache
+from workflow.context import ContextPacker
+from workflow.rerank import RerankingRetriever, get_reranker
 
 load_dotenv()  # Load environment variables from .env file
 
+# The loader, splitter, Pinecone, OpenAI and chain-builder stacks are imported
+# inside the functions that use them, so importing this module stays cheap
 
 
 # Load and split documents
 def load_pdf_file(data_path: str):
     """Load all PDFs from a directory."""
+    from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+
     loader = DirectoryLoader(
         data_path,
         glob="*.pdf",
@@ -31,6 +43,8 @@ def load_pdf_file(data_path: str):
 
 def text_split(extracted_data, chunk_size=800, chunk_overlap=200):
     """Split documents into chunks."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
@@ -38,39 +52,98 @@ def text_split(extracted_data, chunk_size=800, chunk_overlap=200):
     return text_splitter.split_documents(extracted_data)
 
 
-# 2. Setup RAG pipeline
-def build_rag_pipeline(text_chunks):
-    """
-    Build a hybrid RAG pipeline with Pinecone (dense) + BM25 (sparse).
-    Assumes Pinecone index already has embeddings ingested.
-    """
-        # Config
-    index_name = "remote-lock"
+def load_chunks(data_path: str, chunk_size=800, chunk_overlap=200):
+    """Load split chunks from the on-disk chunk store, parsing only new or changed PDFs."""
+    store = ChunkStore(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return store.load(data_path)
+
 
-    # Embeddings + LLM
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    llm = ChatOpenAI(model="gpt-4.1-mini")
+# 2. Setup RAG pipeline
+def build_vector_store(embeddings):
+    """Open the dense vector store selected by `config.VECTOR_BACKEND`."""
+    if config.VECTOR_BACKEND == "local":
+        return LocalVectorIndex.load(
+            config.LOCAL_INDEX_DIR,
+            embeddings,
+            mode=config.LOCAL_INDEX_MODE,
+            nprobe=config.LOCAL_INDEX_NPROBE
+        )
+    if config.VECTOR_BACKEND != "pinecone":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {config.VECTOR_BACKEND!r}")
 
     # Load Pinecone index (no ingestion, just connect)
-    dense_vector = PineconeVectorStore.from_existing_index(
-        index_name=index_name,
+    from langchain_pinecone import PineconeVectorStore
+
+    return PineconeVectorStore.from_existing_index(
+        index_name=config.PINECONE_INDEX_NAME,
         embedding=embeddings
     )
+
+
+def build_rag_models():
+    """Create the embeddings client and LLM used by the pipeline."""
+    # Embeddings + LLM (routed per question between the LOW / RAG / HIGH models)
+    embeddings = cached_openai_embeddings()
+    llm = get_model_router().chat_model("rag")
+    return embeddings, llm
+
+
+def build_rag_clients():
+    """Create the embeddings client, LLM and dense vector store used by the pipeline."""
+    embeddings, llm = build_rag_models()
+    dense_vector = build_vector_store(embeddings)
+    return embeddings, llm, dense_vector
+
+
+def build_hybrid_retriever(text_chunks, dense_vector, k=3):
+    """Dense + BM25 retriever with concurrent legs and per-leg timeouts."""
     dense_retriever = dense_vector.as_retriever(
         search_type="similarity",
-        search_kwargs={"k": 3}
+        search_kwargs={"k": k}
     )
 
-    # BM25 retriever
-    sparse_retriever = BM25Retriever.from_documents(text_chunks)
-    sparse_retriever.k = 3
+    # BM25 retriever (precomputed inverted index, rebuilt only when chunks change),
+    # sharded per category so a category filter searches only its own postings
+    sparse_retriever = SparseIndexRetriever.from_documents(text_chunks, k=k, partition_key=CATEGORY_KEY)
 
-    # Hybrid retriever
-    hybrid_retriever = EnsembleRetriever(
+    # Hybrid retriever (legs run concurrently; a slow leg is dropped after its timeout)
+    return HybridRetriever(
         retrievers=[dense_retriever, sparse_retriever],
-        weights=[0.7, 0.3]
+        weights=[0.7, 0.3],
+        names=["dense", "sparse"],
+        timeouts=[config.DENSE_TIMEOUT_S, config.SPARSE_TIMEOUT_S]
+    )
+
+
+def build_retriever(text_chunks, dense_vector):
+    """
+    Hybrid retriever, optionally followed by the cross-encoder rerank stage
+    (over-fetch RERANK_CANDIDATES per leg, keep RERANK_TOP_N).
+    """
+    if not config.RERANK_ENABLED:
+        return build_hybrid_retriever(text_chunks, dense_vector)
+    return RerankingRetriever(
+        retriever=build_hybrid_retriever(text_chunks, dense_vector, k=config.RERANK_CANDIDATES),
+        reranker=get_reranker(),
+        top_n=config.RERANK_TOP_N
     )
 
+
+def build_context_packer():
+    return ContextPacker(
+        token_budget=config.CONTEXT_TOKEN_BUDGET,
+        dedup_threshold=config.CONTEXT_DEDUP_THRESHOLD
+    )
+
+
+def build_document_chain(llm, packer=None):
+    """
+    Stuff-documents chain that answers `input` from the `context` documents.
+    The context is packed (merged, deduplicated, token-budgeted) first.
+    """
+    from langchain.prompts import PromptTemplate
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
     # Prompt
     prompt = PromptTemplate.from_template("""
     Answer the question based on the context below.
@@ -83,7 +156,26 @@ def build_rag_pipeline(text_chunks):
     """)
 
     # Document chain
-    document_chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
+    packer = packer or build_context_packer()
+    pack_context = RunnableLambda(lambda inputs: packer.pack(inputs["context"]), name="pack_context")
+    return RunnablePassthrough.assign(context=pack_context) | create_stuff_documents_chain(llm=llm, prompt=prompt)
+
+
+def build_rag_pipeline(text_chunks, llm=None, dense_vector=None, retriever=None, document_chain=None):
+    """
+    Build a hybrid RAG pipeline with a dense vector store + BM25 (sparse).
+    Assumes the dense store already has embeddings ingested (see workflow/ingest.py).
+    Pass `llm` / `dense_vector` / `retriever` / `document_chain` to reuse existing components.
+    """
+    if (llm is None and document_chain is None) or (dense_vector is None and retriever is None):
+        _, default_llm, default_dense = build_rag_clients()
+        llm = llm or default_llm
+        dense_vector = dense_vector or default_dense
+
+    hybrid_retriever = retriever or build_hybrid_retriever(text_chunks, dense_vector)
+    document_chain = document_chain or build_document_chain(llm)
+
+    from langchain.chains.retrieval import create_retrieval_chain
 
     # RAG chain
     rag_chain = create_retrieval_chain(
@@ -94,14 +186,308 @@ def build_rag_pipeline(text_chunks):
     return rag_chain
 
 
+# 3. Shared RAG engine
+class _Pipeline:
+    """One immutable build of the index + chain; swapped as a unit on reload."""
+
+    __slots__ = ("chunks", "chunks_by_id", "categories", "fingerprint", "dense_vector", "retriever",
+                 "document_chain", "chain")
+
+    def __init__(self, chunks, dense_vector, retriever, document_chain, chain):
+        self.chunks = chunks
+        self.chunks_by_id = {doc_key(chunk): chunk for chunk in chunks}
+        self.categories = frozenset(chunk.metadata.get(CATEGORY_KEY) for chunk in chunks)
+        self.fingerprint = chunk_set_fingerprint(chunks)
+        self.dense_vector = dense_vector
+        self.retriever = retriever
+        self.document_chain = document_chain
+        self.chain = chain
+
+
+class RagEngine:
+    """
+    Process-wide RAG engine shared by the app and both workflows.
+
+    Clients (embeddings, LLM) are created once; the pipeline (dense store,
+    BM25 index, chain) is built lazily on first use. `reload()` reopens the
+    dense store and builds a fresh pipeline off to the side, then swaps it in
+    with a single assignment, so in-flight queries finish on the pipeline
+    they started with.
+
+    Answers go through a semantic cache keyed on the query embedding; a hit
+    skips retrieval and generation. The cache is dropped whenever the chunk
+    set changes.
+
+    Pass `category` to restrict retrieval to chunks tagged with it (both legs
+    pre-filter, so no top-k slots are spent on other categories); unknown
+    categories and empty filtered results fall back to the whole corpus.
+    """
+
+    def __init__(self, data_path=None):
+        self.data_path = data_path or config.DATA_PATH
+        self.answer_cache = SemanticCache(
+            threshold=config.ANSWER_CACHE_THRESHOLD,
+            max_size=config.ANSWER_CACHE_SIZE,
+            ttl=config.ANSWER_CACHE_TTL
+        ) if config.ANSWER_CACHE_ENABLED else None
+        self.context_packer = build_context_packer()
+        self._clients = None
+        self._pipeline = None
+        self._init_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def _get_clients(self):
+        if self._clients is None:
+            with self._init_lock:
+                if self._clients is None:
+                    self._clients = build_rag_models()
+        return self._clients
+
+    def _build_pipeline(self):
+        embeddings, llm = self._get_clients()
+        # Reopened on every build so a reload also picks up a re-ingested local index
+        dense_vector = build_vector_store(embeddings)
+        text_chunks = load_chunks(self.data_path)
+        retriever = build_retriever(text_chunks, dense_vector)
+        document_chain = build_document_chain(llm, self.context_packer)
+        chain = build_rag_pipeline(text_chunks, retriever=retriever, document_chain=document_chain)
+        return _Pipeline(text_chunks, dense_vector, retriever, document_chain, chain)
+
+    @property
+    def embeddings(self):
+        return self._get_clients()[0]
+
+    @property
+    def pipeline(self):
+        pipeline = self._pipeline
+        if pipeline is None:
+            with self._reload_lock:
+                if self._pipeline is None:
+                    self._pipeline = self._build_pipeline()
+                pipeline = self._pipeline
+        return pipeline
+
+    @property
+    def chain(self):
+        return self.pipeline.chain
+
+    def warmup(self):
+        """Build the pipeline (and load the rerank model) now instead of on the first query."""
+        self.pipeline
+        if config.RERANK_ENABLED:
+            get_reranker().model
+        return self
+
+    def reload(self):
+        """Rebuild the index from the chunk store and hot-swap it in."""
+        with self._reload_lock:
+            self._pipeline = self._build_pipeline()
+        return self
+
+    def leg_latency(self):
+        """Per-leg (dense / sparse / rerank) retrieval latency percentiles in ms."""
+        return self.pipeline.retriever.leg_latency()
+
+    def cache_stats(self):
+        """Semantic answer cache hit/miss counts and hit rate."""
+        return self.answer_cache.stats() if self.answer_cache else {}
+
+    def context_stats(self):
+        """Prompt tokens before / after context packing, totals and per query."""
+        return self.context_packer.stats()
+
+    @staticmethod
+    def _category_scope(pipeline, category):
+        """`category` if any chunk carries it, else None (search everything)."""
+        return category if category in pipeline.categories else None
+
+    def _cache_lookup(self, pipeline, query, scope=None):
+        """Return (query_vector, cached_result_or_None)."""
+        with span("answer_cache") as current:
+            embeddings = self._get_clients()[0]
+            vector = embeddings.embed_query(query)
+            hit = self.answer_cache.lookup(vector, pipeline.fingerprint, scope)
+            current.set(hit=hit is not None)
+        if hit is None:
+            return vector, None
+        context = [pipeline.chunks_by_id[cid] for cid in hit.chunk_ids if cid in pipeline.chunks_by_id]
+        return vector, {"input": query, "context": context, "answer": hit.answer, "cached": True}
+
+    def _cache_store(self, pipeline, query, vector, result, scope=None):
+        chunk_ids = [doc_key(doc) for doc in result.get("context", [])]
+        self.answer_cache.store(query, vector, result["answer"], chunk_ids, pipeline.fingerprint, scope)
+
+    @staticmethod
+    def _route_config(config, query):
+        """Run config that tells the model router to score `query`, not the stuffed prompt."""
+        config = dict(config or {})
+        config["metadata"] = {**config.get("metadata", {}), "route_text": query}
+        return config
+
+    # Retrieval and generation run as two steps (what create_retrieval_chain
+    # does) so each gets its own span
+    def _retrieve(self, pipeline, query, config=None, scope=None):
+        with span("retrieval", category=scope) as current:
+            docs = pipeline.retriever.invoke(query, config, filter={CATEGORY_KEY: scope}) if scope else []
+            if not docs:
+                docs = pipeline.retriever.invoke(query, config)
+            current.set(docs=len(docs))
+        return docs
+
+    async def _aretrieve(self, pipeline, query, config=None, scope=None):
+        with span("retrieval", category=scope) as current:
+            docs = await pipeline.retriever.ainvoke(query, config, filter={CATEGORY_KEY: scope}) if scope else []
+            if not docs:
+                docs = await pipeline.retriever.ainvoke(query, config)
+            current.set(docs=len(docs))
+        return docs
+
+    def batch_retrieve(self, queries, categories=None):
+        """
+        Hybrid retrieval for many queries at once (one embedding batch, one
+        BM25 pass, one dense search per block). Categories are handled as in
+        `_retrieve`: unknown ones search everything, and queries whose filtered
+        results are empty are retried unfiltered.
+        """
+        pipeline = self.pipeline
+        categories = categories or [None] * len(queries)
+        scopes = [self._category_scope(pipeline, category) for category in categories]
+        filters = [{CATEGORY_KEY: scope} if scope else None for scope in scopes]
+        with span("retrieval.batch", queries=len(queries)) as current:
+            results = pipeline.retriever.batch_retrieve(queries, filters)
+            retry = [i for i, (docs, filter) in enumerate(zip(results, filters)) if filter and not docs]
+            if retry:
+                for i, docs in zip(retry, pipeline.retriever.batch_retrieve([queries[i] for i in retry])):
+                    results[i] = docs
+            current.set(unfiltered_retries=len(retry))
+        return results
+
+    def invoke(self, inputs, config=None, category=None, **kwargs):
+        with span("rag", streaming=False) as current:
+            pipeline = self.pipeline
+            scope = self._category_scope(pipeline, category)
+            vector, cached = (
+                self._cache_lookup(pipeline, inputs["input"], scope)
+                if self.answer_cache is not None else (None, None)
+            )
+            current.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+
+            docs = self._retrieve(pipeline, inputs["input"], config, scope)
+            with span("llm") as llm_span:
+                answer = pipeline.document_chain.invoke(
+                    {**inputs, "context": docs}, self._route_config(config, inputs["input"]), **kwargs
+                )
+                llm_span.set(output_tokens=count_tokens(answer))
+            result = {**inputs, "context": docs, "answer": answer}
+            if vector is not None:
+                self._cache_store(pipeline, inputs["input"], vector, result, scope)
+            return result
+
+    async def ainvoke(self, inputs, config=None, category=None, **kwargs):
+        with span("rag", streaming=False) as current:
+            pipeline = self.pipeline
+            scope = self._category_scope(pipeline, category)
+            vector, cached = (
+                await asyncio.to_thread(self._cache_lookup, pipeline, inputs["input"], scope)
+                if self.answer_cache is not None else (None, None)
+            )
+            current.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+
+            docs = await self._aretrieve(pipeline, inputs["input"], config, scope)
+            with span("llm") as llm_span:
+                answer = await pipeline.document_chain.ainvoke(
+                    {**inputs, "context": docs}, self._route_config(config, inputs["input"]), **kwargs
+                )
+                llm_span.set(output_tokens=count_tokens(answer))
+            result = {**inputs, "context": docs, "answer": answer}
+            if vector is not None:
+                self._cache_store(pipeline, inputs["input"], vector, result, scope)
+            return result
+
+    def stream_answer(self, query, config=None, category=None):
+        """Yield answer tokens as the LLM produces them (a cache hit yields the whole answer once)."""
+        with span("rag", streaming=True) as current:
+            pipeline = self.pipeline
+            scope = self._category_scope(pipeline, category)
+            vector, cached = self._cache_lookup(pipeline, query, scope) if self.answer_cache is not None else (None, None)
+            current.set(cached=cached is not None)
+            if cached is not None:
+                yield cached["answer"]
+                return
+
+            docs = self._retrieve(pipeline, query, config, scope)
+            answer = ""
+            with span("llm") as llm_span:
+                started = time.perf_counter()
+                for token in pipeline.document_chain.stream(
+                    {"input": query, "context": docs}, self._route_config(config, query)
+                ):
+                    if not answer:
+                        llm_span.set(ttft_ms=(time.perf_counter() - started) * 1000.0)
+                    answer += token
+                    yield token
+                llm_span.set(output_tokens=count_tokens(answer))
+            if vector is not None:
+                self._cache_store(pipeline, query, vector, {"context": docs, "answer": answer}, scope)
+
+    async def aretrieve(self, query, config=None, category=None):
+        """Hybrid retrieval only; pass the result to `astream_answer(docs=...)`."""
+        pipeline = self.pipeline
+        return await self._aretrieve(pipeline, query, config, self._category_scope(pipeline, category))
+
+    async def astream_answer(self, query, config=None, docs=None, category=None):
+        """Async version of `stream_answer`; `docs` skips retrieval when already fetched."""
+        with span("rag", streaming=True) as current:
+            pipeline = self.pipeline
+            scope = self._category_scope(pipeline, category)
+            vector, cached = (
+                await asyncio.to_thread(self._cache_lookup, pipeline, query, scope)
+                if self.answer_cache is not None else (None, None)
+            )
+            current.set(cached=cached is not None)
+            if cached is not None:
+                yield cached["answer"]
+                return
+
+            if docs is None:
+                docs = await self._aretrieve(pipeline, query, config, scope)
+            answer = ""
+            with span("llm") as llm_span:
+                started = time.perf_counter()
+                async for token in pipeline.document_chain.astream(
+                    {"input": query, "context": docs}, self._route_config(config, query)
+                ):
+                    if not answer:
+                        llm_span.set(ttft_ms=(time.perf_counter() - started) * 1000.0)
+                    answer += token
+                    yield token
+                llm_span.set(output_tokens=count_tokens(answer))
+            if vector is not None:
+                self._cache_store(pipeline, query, vector, {"context": docs, "answer": answer}, scope)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_rag_engine():
+    """Return the process-wide RAG engine, creating it on first call."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RagEngine()
+    return _engine
+
+
 # Example usage (if run directly)
 if __name__ == "__main__":
     # If you still want local BM25 support, load text_chunks
-    extracted_data = load_pdf_file("Data/")
-    text_chunks = text_split(extracted_data)
-
-    rag_chain = build_rag_pipeline(text_chunks)
+    rag_engine = get_rag_engine().warmup()
 
     # Test query
-    result = rag_chain.invoke({"input": "What is remote lock?"})
+    result = rag_engine.invoke({"input": "What is remote lock?"})
     print(result["answer"])
@@ -0,0 +1,157 @@
+# workflow/rerank.py
+"""
+Optional cross-encoder rerank stage.
+
+The hybrid retriever over-fetches candidates; a small local cross-encoder
+(sentence-transformers) scores every (query, chunk) pair in batches on CPU
+and only the top-n go on to the LLM. The model is loaded once per process,
+dynamically quantized to int8 where torch supports it, and scores are cached
+per (query, chunk id).
+"""
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from src import config
+from src.tracing import span
+from workflow.hybrid import LegStats, doc_key
+
+logger = logging.getLogger(__name__)
+
+
+def load_cross_encoder(model_name, quantize=True):
+    """Load a sentence-transformers CrossEncoder on CPU, int8-quantizing its Linear layers."""
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name, device="cpu")
+    if quantize:
+        try:
+            import torch
+            model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+        except Exception:
+            logger.warning("Dynamic quantization unavailable; using the fp32 cross-encoder", exc_info=True)
+    return model
+
+
+class CrossEncoderReranker:
+    """Batched cross-encoder scoring with a per-(query, chunk) score cache."""
+
+    def __init__(self, model_name, batch_size=32, quantize=True, cache_size=10_000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.quantize = quantize
+        self.cache_size = cache_size
+        self.stats = LegStats()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores = OrderedDict()  # (query, chunk key) -> score
+        self._cache_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = load_cross_encoder(self.model_name, self.quantize)
+        return self._model
+
+    def score(self, query, docs):
+        """Relevance score per document, in input order."""
+        keys = [(query, doc_key(doc)) for doc in docs]
+        scores = [None] * len(docs)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = self.model.predict(
+                [(query, docs[i].page_content) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._cache_lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = scores[i]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query, docs, top_n):
+        """Top-n documents by cross-encoder score, with metadata["rerank_score"] set."""
+        if not docs:
+            return []
+        with span("rerank", candidates=len(docs)):
+            started = time.perf_counter()
+            try:
+                scores = self.score(query, docs)
+            except Exception:
+                self.stats.errors += 1
+                logger.exception("rerank failed; keeping the fused order")
+                return list(docs)[:top_n]
+            self.stats.latencies.append(time.perf_counter() - started)
+
+        ranked = sorted(zip(scores, range(len(docs))), key=lambda item: -item[0])[:top_n]
+        return [
+            Document(
+                page_content=docs[i].page_content,
+                metadata={**docs[i].metadata, "rerank_score": score},
+                id=docs[i].id
+            )
+            for score, i in ranked
+        ]
+
+
+# ---------------- Retriever ---------------- #
+class RerankingRetriever(BaseRetriever):
+    """Wraps a (hybrid) retriever and keeps the cross-encoder's top-n of its results."""
+
+    retriever: BaseRetriever
+    reranker: Any
+    top_n: int = 4
+
+    def leg_latency(self):
+        """Underlying leg latencies plus the rerank stage."""
+        legs = self.retriever.leg_latency() if hasattr(self.retriever, "leg_latency") else {}
+        return {**legs, "rerank": self.reranker.stats.summary()}
+
+    def _get_relevant_documents(self, query, *, run_manager, **kwargs):
+        docs = self.retriever.invoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        return self.reranker.rerank(query, docs, self.top_n)
+
+    async def _aget_relevant_documents(self, query, *, run_manager, **kwargs):
+        docs = await self.retriever.ainvoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        return await asyncio.to_thread(self.reranker.rerank, query, docs, self.top_n)
+
+    def batch_retrieve(self, queries, filters=None):
+        """Batched candidates from the wrapped retriever, each reranked to the top-n."""
+        candidates = self.retriever.batch_retrieve(queries, filters)
+        return [self.reranker.rerank(query, docs, self.top_n) for query, docs in zip(queries, candidates)]
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Process-wide reranker configured from src/config.py (the model loads on first use)."""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker(
+                    config.RERANK_MODEL,
+                    batch_size=config.RERANK_BATCH_SIZE,
+                    quantize=config.RERANK_QUANTIZE,
+                    cache_size=config.RERANK_CACHE_SIZE
+                )
+    return _reranker
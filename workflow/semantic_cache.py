@@ -0,0 +1,159 @@
+# workflow/semantic_cache.py
+"""
+Semantic answer cache for the RAG chain.
+
+Entries map a query embedding to the generated answer and the ids of the
+chunks it was grounded on. A lookup returns the closest entry whose cosine
+similarity clears the threshold within the same scope (e.g. the category
+the retrieval was filtered to). Entries are evicted LRU / by TTL, and the
+whole cache is dropped when the corpus fingerprint changes.
+"""
+import time
+import heapq
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class CachedAnswer:
+    __slots__ = ("query", "vector", "answer", "chunk_ids", "stored_at", "scope")
+
+    def __init__(self, query, vector, answer, chunk_ids, stored_at, scope=None):
+        self.query = query
+        self.vector = vector
+        self.answer = answer
+        self.chunk_ids = chunk_ids
+        self.stored_at = stored_at
+        self.scope = scope
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour answer cache with LRU + TTL eviction.
+
+    Vectors live in a preallocated (max_size, dim) matrix; a store writes one
+    row into a free slot and an eviction frees it, so nothing is re-stacked.
+    Expiry walks a deque ordered by store time, and scopes are kept as integer
+    codes next to the rows so the scope mask is one vectorized comparison.
+    """
+
+    def __init__(self, threshold=0.95, max_size=1000, ttl=3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None  # (max_size, dim) float32, allocated on the first store
+        self._entries = [None] * max_size  # slot -> CachedAnswer
+        self._live = np.zeros(max_size, dtype=bool)
+        self._scopes = np.zeros(max_size, dtype=np.int32)  # slot -> scope code
+        self._scope_codes = {}  # scope -> code
+        self._generation = np.zeros(max_size, dtype=np.int64)  # bumped when a slot is reused
+        self._lru = OrderedDict()  # slot -> None, least recently used first
+        self._expiry = deque()  # (stored_at, slot, generation), oldest first
+        self._free = list(range(max_size))  # min-heap, so live rows stay packed at the front
+        self._used = 0  # 1 + highest slot ever handed out since the last reset
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self._entries = [None] * self.max_size
+        self._live[:] = False
+        self._lru.clear()
+        self._expiry.clear()
+        self._free = list(range(self.max_size))
+        self._used = 0
+
+    def _sync_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            self._reset()
+            self.fingerprint = fingerprint
+
+    def _scope_code(self, scope):
+        code = self._scope_codes.get(scope)
+        if code is None:
+            code = self._scope_codes[scope] = len(self._scope_codes)
+        return code
+
+    def _evict(self, slot):
+        self._live[slot] = False
+        self._entries[slot] = None
+        self._lru.pop(slot, None)
+        heapq.heappush(self._free, slot)
+
+    def lookup(self, vector, fingerprint, scope=None):
+        """Return the best CachedAnswer above the threshold in `scope`, or None."""
+        query = _unit(vector)
+        now = time.time()
+        with self._lock:
+            self._sync_fingerprint(fingerprint)
+            self._evict_expired(now)
+            code = self._scope_codes.get(scope)
+            if not self._lru or code is None or self._matrix is None or len(query) != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            used = self._used
+            scores = self._matrix[:used] @ query
+            scores[~(self._live[:used] & (self._scopes[:used] == code))] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._lru.move_to_end(best)
+            self.hits += 1
+            return self._entries[best]
+
+    def store(self, query, vector, answer, chunk_ids, fingerprint, scope=None):
+        if self.max_size <= 0:
+            return
+        vector = _unit(vector)
+        now = time.time()
+        with self._lock:
+            self._sync_fingerprint(fingerprint)
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                # First store, or the embedding model changed dimension
+                self._matrix = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self._reset()
+            if not self._free:
+                self._evict(next(iter(self._lru)))
+            slot = heapq.heappop(self._free)
+            self._used = max(self._used, slot + 1)
+            self._matrix[slot] = vector
+            self._live[slot] = True
+            self._scopes[slot] = self._scope_code(scope)
+            self._generation[slot] += 1
+            self._entries[slot] = CachedAnswer(query, vector, answer, list(chunk_ids), now, scope)
+            self._lru[slot] = None
+            self._expiry.append((now, slot, self._generation[slot]))
+
+    def _evict_expired(self, now):
+        if self.ttl is None:
+            self._expiry.clear()
+            return
+        while self._expiry and now - self._expiry[0][0] > self.ttl:
+            _, slot, generation = self._expiry.popleft()
+            # Skip slots that were evicted (LRU) or reused since this entry was stored
+            if self._live[slot] and self._generation[slot] == generation:
+                self._evict(slot)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
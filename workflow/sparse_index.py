@@ -0,0 +1,322 @@
+# workflow/sparse_index.py
+"""
+Precomputed BM25 inverted index with CSR-style postings.
+
+Every posting stores its full BM25 term weight, so scoring a query is a
+gather over the postings of its terms plus one vectorized accumulation;
+documents that share no term with the query are never touched. The arrays
+are saved as `.npy` files and memory-mapped, and are rebuilt only when the
+chunk set changes. Each save goes to a fresh version directory that is
+published by atomically replacing the CURRENT pointer, so a reader never
+mixes files from two builds.
+
+With a partition key (e.g. "category") one extra index is built per
+partition value, so a filtered query only touches its own shard.
+
+`search_batch` scores many queries at once: the postings of every
+(query, term) pair are gathered together and accumulated into one
+queries x documents matrix with a single bincount, in blocks that keep the
+matrix under BATCH_SCORE_CELLS entries.
+"""
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+from pathlib import Path
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+
+from src import config
+from workflow.chunk_store import matches_filter
+
+CURRENT_FILE = "CURRENT"  # name of the live version directory
+META_FILE = "meta.json"
+VOCAB_FILE = "vocab.json"
+ARRAY_FILES = ("indptr", "doc_ids", "weights")
+BATCH_SCORE_CELLS = 1 << 24  # queries x docs entries scored per block (~128 MB as float64)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _partition_dir(index_dir, value):
+    slug = re.sub(r"[^\w.-]+", "_", str(value))[:40]
+    return Path(index_dir) / "partitions" / f"{slug}-{hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:8]}"
+
+
+def corpus_fingerprint(chunks, k1, b):
+    digest = hashlib.sha1(f"{k1}|{b}".encode("utf-8"))
+    for chunk in chunks:
+        digest.update(chunk.metadata.get("chunk_id", chunk.page_content).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# ---------------- Index ---------------- #
+def _rank(docs, scores, k):
+    """Positions of the top-k `scores`, best first; ties go to the lower doc id."""
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((docs[candidates], -scores[candidates]))[:k]]
+
+
+class SparseIndex:
+    """BM25 postings in CSR layout: postings of term t live at [indptr[t], indptr[t+1])."""
+
+    def __init__(self, vocab, indptr, doc_ids, weights, n_docs):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        doc_tfs = [Counter(tokenize(text)) for text in texts]
+        doc_lens = np.array([sum(tf.values()) for tf in doc_tfs], dtype=np.float32)
+        avgdl = float(doc_lens.mean()) if len(doc_lens) else 0.0
+
+        postings = {}
+        for doc_id, tf in enumerate(doc_tfs):
+            for term, count in tf.items():
+                postings.setdefault(term, []).append((doc_id, count))
+
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term, i in vocab.items():
+            indptr[i + 1] = len(postings[term])
+        np.cumsum(indptr, out=indptr)
+
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for term, i in vocab.items():
+            ids, counts = zip(*postings[term])
+            doc_ids[indptr[i]:indptr[i + 1]] = ids
+            tfs[indptr[i]:indptr[i + 1]] = counts
+
+        n_docs = len(texts)
+        df = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        term_of_posting = np.repeat(np.arange(len(vocab)), np.diff(indptr))
+        norm = k1 * (1.0 - b + b * doc_lens[doc_ids] / (avgdl or 1.0))
+        weights = (idf[term_of_posting] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        return cls(vocab, indptr, doc_ids, weights, n_docs)
+
+    def save(self, index_dir, fingerprint):
+        """Write a new version directory, then point CURRENT at it with one atomic rename."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        version = f"v-{fingerprint[:12]}-{uuid.uuid4().hex[:8]}"
+        version_dir = index_dir / version
+        version_dir.mkdir()
+        for name in ARRAY_FILES:
+            np.save(version_dir / f"{name}.npy", getattr(self, name))
+        with open(version_dir / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f)
+        with open(version_dir / META_FILE, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "n_docs": self.n_docs}, f)
+
+        tmp = index_dir / f"{CURRENT_FILE}.{version}.tmp"
+        tmp.write_text(version, encoding="utf-8")
+        os.replace(tmp, index_dir / CURRENT_FILE)
+        # Processes that already mapped an old version keep reading its (unlinked) files
+        for old in index_dir.glob("v-*"):
+            if old.name != version:
+                shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir, fingerprint):
+        """Memory-map the current saved version, or return None if it is missing or stale."""
+        try:
+            index_dir = Path(index_dir) / (Path(index_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+            with open(index_dir / META_FILE, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != fingerprint:
+                return None
+            with open(index_dir / VOCAB_FILE, "r", encoding="utf-8") as f:
+                vocab = json.load(f)
+            arrays = {name: np.load(index_dir / f"{name}.npy", mmap_mode="r") for name in ARRAY_FILES}
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            return None
+        return cls(vocab, n_docs=meta["n_docs"], **arrays)
+
+    def score(self, query):
+        """Return (doc_ids, scores) for documents sharing at least one term with `query`."""
+        term_ids = [(self.vocab[t], n) for t, n in Counter(tokenize(query)).items() if t in self.vocab]
+        if not term_ids:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        ids = np.concatenate([self.doc_ids[self.indptr[t]:self.indptr[t + 1]] for t, _ in term_ids])
+        weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] * n for t, n in term_ids])
+        docs, inverse = np.unique(ids, return_inverse=True)
+        return docs, np.bincount(inverse, weights=weights).astype(np.float32)
+
+    def search(self, query, k, allowed=None):
+        """
+        Return [(doc_id, score), ...] for the top-k documents, best first;
+        `allowed(doc_id)` restricts the candidates.
+        """
+        docs, scores = self.score(query)
+        if allowed is not None and len(docs):
+            keep = np.fromiter((allowed(int(d)) for d in docs), dtype=bool, count=len(docs))
+            docs, scores = docs[keep], scores[keep]
+        top = _rank(docs, scores, k)
+        return [(int(docs[i]), float(scores[i])) for i in top]
+
+    def score_batch(self, queries):
+        """(len(queries), n_docs) BM25 score matrix; 0 where a document shares no term."""
+        query_ids, starts, ends, counts = [], [], [], []
+        for q, query in enumerate(queries):
+            for term, n in Counter(tokenize(query)).items():
+                t = self.vocab.get(term)
+                if t is not None:
+                    query_ids.append(q)
+                    starts.append(self.indptr[t])
+                    ends.append(self.indptr[t + 1])
+                    counts.append(n)
+        if not query_ids:
+            return np.zeros((len(queries), self.n_docs), dtype=np.float32)
+
+        starts, lengths = np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64) - starts
+        # Posting positions of every (query, term) slice, concatenated without a Python loop
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        postings = np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+        rows = np.repeat(np.array(query_ids, dtype=np.int64), lengths)
+        weights = self.weights[postings] * np.repeat(np.array(counts, dtype=np.float32), lengths)
+        flat = rows * self.n_docs + self.doc_ids[postings]
+        scores = np.bincount(flat, weights=weights, minlength=len(queries) * self.n_docs)
+        return scores.reshape(len(queries), self.n_docs).astype(np.float32)
+
+    def search_batch(self, queries, k, masks=None):
+        """
+        `search` for many queries: [[(doc_id, score), ...], ...], best first.
+        `masks[i]` (a bool array over documents, or None) restricts query i.
+        """
+        results = []
+        block = max(1, BATCH_SCORE_CELLS // max(self.n_docs, 1))
+        for start in range(0, len(queries), block):
+            scores = self.score_batch(queries[start:start + block])
+            if masks is not None:
+                for row, mask in enumerate(masks[start:start + block]):
+                    if mask is not None:
+                        scores[row, ~mask] = 0.0
+            for row in scores:
+                docs = np.flatnonzero(row > 0)
+                top = docs[_rank(docs, row[docs], k)]
+                results.append([(int(d), float(row[d])) for d in top])
+        return results
+
+
+def load_or_build_index(chunks, index_dir=None, k1=1.5, b=0.75):
+    """Return the saved index for `chunks`, building and saving it only if the chunk set changed."""
+    index_dir = index_dir or config.SPARSE_INDEX_DIR
+    fingerprint = corpus_fingerprint(chunks, k1, b)
+    index = SparseIndex.load(index_dir, fingerprint)
+    if index is None:
+        index = SparseIndex.build([chunk.page_content for chunk in chunks], k1=k1, b=b)
+        index.save(index_dir, fingerprint)
+    return index
+
+
+# ---------------- Retriever ---------------- #
+class SparseIndexRetriever(BaseRetriever):
+    """
+    BM25 retriever backed by a SparseIndex; drop-in for BM25Retriever.
+
+    Accepts a metadata `filter` dict at query time (`invoke(query, filter=...)`).
+    A filter on `partition_key` is served by that partition's own index.
+    """
+
+    index: Any
+    docs: List[Document]
+    k: int = 4
+    partition_key: Optional[str] = None
+    partitions: Dict[str, Any] = {}  # partition value -> SparseIndexRetriever
+
+    @classmethod
+    def from_documents(cls, documents, index_dir=None, partition_key=None, **kwargs):
+        documents = list(documents)
+        index_dir = index_dir or config.SPARSE_INDEX_DIR
+        partitions = {}
+        if partition_key:
+            groups = {}
+            for doc in documents:
+                groups.setdefault(doc.metadata.get(partition_key), []).append(doc)
+            if len(groups) > 1:
+                partitions = {
+                    str(value): cls(index=load_or_build_index(docs, _partition_dir(index_dir, value)), docs=docs, **kwargs)
+                    for value, docs in groups.items()
+                    if value is not None
+                }
+        return cls(
+            index=load_or_build_index(documents, index_dir),
+            docs=documents,
+            partition_key=partition_key,
+            partitions=partitions,
+            **kwargs
+        )
+
+    def _search(self, query, filter=None):
+        allowed = (lambda doc_id: matches_filter(self.docs[doc_id].metadata, filter)) if filter else None
+        return [self.docs[doc_id] for doc_id, _ in self.index.search(query, self.k, allowed)]
+
+    def _get_relevant_documents(self, query, *, run_manager=None, filter=None):
+        if filter and self.partition_key in filter:
+            shard = self.partitions.get(str(filter[self.partition_key]))
+            if shard is not None:
+                rest = {key: value for key, value in filter.items() if key != self.partition_key}
+                return shard._search(query, rest)
+        return self._search(query, filter)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None, filter=None):
+        return await run_in_executor(None, self._get_relevant_documents, query, filter=filter)
+
+    def _search_batch(self, queries, filters):
+        masks = None
+        if any(filters):
+            cache = {}
+            masks = []
+            for filter in filters:
+                key = json.dumps(filter, sort_keys=True, default=str) if filter else None
+                if key is not None and key not in cache:
+                    cache[key] = np.fromiter(
+                        (matches_filter(doc.metadata, filter) for doc in self.docs), dtype=bool, count=len(self.docs)
+                    )
+                masks.append(cache.get(key))
+        hits = self.index.search_batch(list(queries), self.k, masks)
+        return [[self.docs[doc_id] for doc_id, _ in row] for row in hits]
+
+    def search_batch(self, queries, filters=None):
+        """Top-k documents for every query in one scoring pass per shard; `filters[i]` applies to query i."""
+        queries = list(queries)
+        filters = list(filters) if filters is not None else [None] * len(queries)
+        # Same routing as `_get_relevant_documents`, so batch and single-query scores agree
+        groups = {}
+        for i, filter in enumerate(filters):
+            target, rest = self, filter
+            if filter and self.partition_key in filter:
+                shard = self.partitions.get(str(filter[self.partition_key]))
+                if shard is not None:
+                    target = shard
+                    rest = {key: value for key, value in filter.items() if key != self.partition_key}
+            groups.setdefault(id(target), (target, []))[1].append((i, rest))
+        results = [None] * len(queries)
+        for target, members in groups.values():
+            hits = target._search_batch([queries[i] for i, _ in members], [rest for _, rest in members])
+            for (i, _), docs in zip(members, hits):
+                results[i] = docs
+        return results
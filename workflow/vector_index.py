@@ -0,0 +1,316 @@
+# workflow/vector_index.py
+"""
+In-process dense vector index, usable in place of PineconeVectorStore.
+
+Vectors are stored L2-normalized in a float32 `.npy` matrix that is
+memory-mapped at load time, so cosine similarity is a single mat-vec
+product followed by an `argpartition` top-k. For large corpora an IVF mode
+clusters the rows with k-means and only scans the `nprobe` nearest lists.
+A metadata `filter` (e.g. {"category": "Billing"}) restricts the scan to that
+partition's rows, which are computed once and reused until the next write.
+Writes stay in memory until `save()`, which compacts, persists and rebuilds
+the IVF lists once per batch of writes.
+`similarity_search_by_vectors` answers many queries with one matrix-matrix
+product per block (always exact; IVF pays off per query, not per batch).
+"""
+import os
+import json
+import uuid
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from workflow.chunk_store import matches_filter
+
+VECTORS_FILE = "vectors.npy"
+DOCS_FILE = "docs.jsonl"
+CENTROIDS_FILE = "ivf_centroids.npy"
+LISTS_FILE = "ivf_lists.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+BATCH_SCORE_CELLS = 1 << 24  # queries x rows similarities computed per block
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def kmeans(matrix, n_clusters, n_iter=10, seed=0):
+    """Spherical k-means over normalized rows; returns (centroids, assignments)."""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(matrix @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = matrix[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(matrix @ centroids.T, axis=1)
+
+
+# ---------------- Local Vector Index ---------------- #
+class _Rows:
+    """
+    One version of the index contents. Writers build a new one and publish it
+    with a single assignment, so a search always sees a consistent set.
+    """
+
+    __slots__ = ("vectors", "ids", "texts", "metadatas", "alive", "row_by_id",
+                 "centroids", "lists", "offsets", "ivf_rows", "partitions")
+
+    def __init__(self, vectors=None, ids=(), texts=(), metadatas=(), alive=None,
+                 centroids=None, lists=None, offsets=None, ivf_rows=0):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.alive = alive if alive is not None else np.ones(len(ids), dtype=bool)
+        self.row_by_id = {doc_id: i for i, doc_id in enumerate(ids) if self.alive[i]}
+        self.centroids = centroids
+        self.lists = lists
+        self.offsets = offsets
+        self.ivf_rows = ivf_rows  # rows covered by the IVF lists; later rows are always scanned
+        self.partitions = {}  # filter key -> row indices
+
+    def partition_rows(self, filter):
+        key = json.dumps(filter, sort_keys=True, default=str)
+        rows = self.partitions.get(key)
+        if rows is None:
+            rows = np.flatnonzero([matches_filter(meta, filter) for meta in self.metadatas]).astype(np.int64)
+            self.partitions[key] = rows
+        return rows
+
+    def document(self, row):
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]), id=self.ids[row])
+
+
+class LocalVectorIndex(VectorStore):
+    """
+    Memory-mapped NumPy vector store.
+
+    mode="exact" scans every row; mode="ivf" scans only the `nprobe` closest
+    k-means lists and is rebuilt on save once the index has `ivf_min_rows` rows.
+    Writes only change the in-memory index; call `save()` once after a batch
+    of writes to compact and persist it.
+    """
+
+    def __init__(self, embedding, index_dir, mode="exact", nprobe=8, ivf_min_rows=10_000):
+        self._embedding = embedding
+        self.index_dir = Path(index_dir)
+        self.mode = mode
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self._rows = _Rows()
+        self._write_lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # ---------------- Persistence ---------------- #
+    @classmethod
+    def load(cls, index_dir, embedding, **kwargs):
+        """Open an index directory, memory-mapping the vectors if it exists."""
+        index = cls(embedding, index_dir, **kwargs)
+        vectors_path = index.index_dir / VECTORS_FILE
+        if not vectors_path.exists():
+            return index
+
+        vectors = np.load(vectors_path, mmap_mode="r")
+        ids, texts, metadatas = [], [], []
+        with open(index.index_dir / DOCS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row["id"])
+                texts.append(row["text"])
+                metadatas.append(row["metadata"])
+
+        ivf = {}
+        if (index.index_dir / CENTROIDS_FILE).exists():
+            ivf = {
+                "centroids": np.load(index.index_dir / CENTROIDS_FILE, mmap_mode="r"),
+                "lists": np.load(index.index_dir / LISTS_FILE, mmap_mode="r"),
+                "offsets": np.load(index.index_dir / OFFSETS_FILE),
+                "ivf_rows": len(ids),
+            }
+        index._rows = _Rows(vectors, ids, texts, metadatas, **ivf)
+        return index
+
+    def save(self):
+        """Compact deleted rows and write the index atomically, then re-map it."""
+        with self._write_lock:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            rows = self._rows
+            keep = np.flatnonzero(rows.alive)
+            dim = rows.vectors.shape[1] if rows.vectors is not None else 0
+            vectors = np.asarray(rows.vectors[keep]) if len(keep) else np.zeros((0, dim), dtype=np.float32)
+
+            self._write_npy(VECTORS_FILE, vectors)
+            tmp = self.index_dir / f"{DOCS_FILE}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for i in keep:
+                    f.write(json.dumps({"id": rows.ids[i], "text": rows.texts[i], "metadata": rows.metadatas[i]}) + "\n")
+            os.replace(tmp, self.index_dir / DOCS_FILE)
+
+            ivf = self._build_ivf(vectors)
+            self._rows = _Rows(
+                np.load(self.index_dir / VECTORS_FILE, mmap_mode="r"),
+                [rows.ids[i] for i in keep],
+                [rows.texts[i] for i in keep],
+                [rows.metadatas[i] for i in keep],
+                **ivf
+            )
+
+    def _write_npy(self, name, array):
+        tmp = self.index_dir / f"{name}.tmp.npy"
+        np.save(tmp, array)
+        os.replace(tmp, self.index_dir / name)
+
+    def _build_ivf(self, vectors):
+        for name in (CENTROIDS_FILE, LISTS_FILE, OFFSETS_FILE):
+            (self.index_dir / name).unlink(missing_ok=True)
+        if self.mode != "ivf" or len(vectors) < self.ivf_min_rows:
+            return {}
+
+        n_lists = int(np.sqrt(len(vectors)))
+        centroids, assign = kmeans(vectors, n_lists)
+        lists = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))]).astype(np.int64)
+        self._write_npy(CENTROIDS_FILE, centroids)
+        self._write_npy(LISTS_FILE, lists)
+        self._write_npy(OFFSETS_FILE, offsets)
+        return {"centroids": centroids, "lists": lists, "offsets": offsets, "ivf_rows": len(vectors)}
+
+    # ---------------- Writes ---------------- #
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        returned = ids
+        last = {doc_id: i for i, doc_id in enumerate(ids)}
+        if len(last) < len(ids):
+            # An id repeated within the batch keeps only its last occurrence
+            keep = sorted(last.values())
+            texts, metadatas, ids = [texts[i] for i in keep], [metadatas[i] for i in keep], [ids[i] for i in keep]
+        new_vectors = _normalize(self._embedding.embed_documents(texts))
+
+        with self._write_lock:
+            rows = self._rows
+            # Re-adding an id replaces the old row
+            alive = self._without(rows, ids)
+            if rows.vectors is None or len(rows.vectors) == 0:
+                vectors = new_vectors
+            else:
+                vectors = np.vstack([np.asarray(rows.vectors), new_vectors])
+            self._rows = _Rows(
+                vectors, [*rows.ids, *ids], [*rows.texts, *texts], [*rows.metadatas, *metadatas],
+                np.concatenate([alive, np.ones(len(ids), dtype=bool)]),
+                rows.centroids, rows.lists, rows.offsets, rows.ivf_rows
+            )
+        return returned
+
+    @staticmethod
+    def _without(rows, ids):
+        """Copy of `rows.alive` with `ids` marked deleted."""
+        alive = rows.alive.copy()
+        alive[[rows.row_by_id[doc_id] for doc_id in ids if doc_id in rows.row_by_id]] = False
+        return alive
+
+    def delete(self, ids=None, **kwargs):
+        with self._write_lock:
+            rows = self._rows
+            if ids and any(doc_id in rows.row_by_id for doc_id in ids):
+                self._rows = _Rows(
+                    rows.vectors, rows.ids, rows.texts, rows.metadatas, self._without(rows, ids),
+                    rows.centroids, rows.lists, rows.offsets, rows.ivf_rows
+                )
+        return True
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index_dir=None, **kwargs):
+        index = cls(embedding, index_dir, **kwargs)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        index.save()
+        return index
+
+    # ---------------- Search ---------------- #
+    def _candidate_rows(self, rows, query_vector):
+        """Rows to score: everything in exact mode, the nprobe nearest lists in IVF mode."""
+        if rows.centroids is None:
+            return None
+        probe = top_k(np.asarray(rows.centroids) @ query_vector, self.nprobe)
+        return np.concatenate(
+            [rows.lists[rows.offsets[c]:rows.offsets[c + 1]] for c in probe]
+            + [np.arange(rows.ivf_rows, len(rows.ids), dtype=np.int64)]
+        )
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        rows = self._rows
+        if rows.vectors is None or not rows.row_by_id:
+            return []
+        query_vector = _normalize(embedding)
+        candidates = self._candidate_rows(rows, query_vector)
+        if filter:
+            partition = rows.partition_rows(filter)
+            candidates = partition if candidates is None else np.intersect1d(candidates, partition)
+        if candidates is None:
+            scores = rows.vectors @ query_vector
+            scores[~rows.alive] = -np.inf
+        else:
+            candidates = candidates[rows.alive[candidates]]
+            scores = rows.vectors[candidates] @ query_vector
+        best = top_k(scores, k)
+        best_rows = candidates[best] if candidates is not None else best
+        return [(rows.document(r), float(s)) for r, s in zip(best_rows, scores[best]) if np.isfinite(s)]
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filters=None):
+        """[[(doc, score), ...], ...] for many query vectors; `filters[i]` applies to query i."""
+        rows = self._rows
+        if rows.vectors is None or not rows.row_by_id:
+            return [[] for _ in embeddings]
+        queries = _normalize(embeddings)
+        n_rows = len(rows.ids)
+        block = max(1, BATCH_SCORE_CELLS // n_rows)
+        results = []
+        for start in range(0, len(queries), block):
+            scores = queries[start:start + block] @ np.asarray(rows.vectors).T
+            scores[:, ~rows.alive] = -np.inf
+            for row, filter in enumerate((filters or [None] * len(queries))[start:start + block]):
+                if filter:
+                    allowed = np.zeros(n_rows, dtype=bool)
+                    allowed[rows.partition_rows(filter)] = True
+                    scores[row, ~allowed] = -np.inf
+            for row_scores in scores:
+                best = top_k(row_scores, k)
+                results.append([(rows.document(r), float(row_scores[r])) for r in best if np.isfinite(row_scores[r])])
+        return results
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0